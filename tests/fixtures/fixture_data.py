@@ -2,6 +2,7 @@ import tempfile
 
 import pytest
 from mixer.backend.django import mixer as _mixer
+from posts import thumbnails
 from posts.models import Post, Group
 
 
@@ -10,6 +11,8 @@ def mock_media(settings):
     with tempfile.TemporaryDirectory() as temp_directory:
         settings.MEDIA_ROOT = temp_directory
         yield temp_directory
+        # Фоновые миниатюры не должны писать в уже удаляемый каталог.
+        thumbnails.wait()
 
 
 @pytest.fixture
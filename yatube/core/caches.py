@@ -0,0 +1,278 @@
+"""Двухуровневый кэш: LRU в памяти процесса перед общим кэшем.
+
+L1 — небольшой словарь в памяти процесса, L2 — общий для всех
+воркеров бэкенд из CACHES (файловый, memcached). Запись идёт в оба
+уровня, чтение — сначала из L1.
+
+Сброс между процессами держится на версионных ключах: поколения
+(``generation:``) и другие ключи из L2_ONLY читаются только из L2,
+а страницы и фрагменты сверяются с ними при каждом чтении. Остальное
+живёт в L1 не дольше L1_TIMEOUT секунд: это либо ключи с содержимым
+внутри (карточки), либо приблизительные значения (счётчики).
+"""
+import itertools
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.files import locks
+from django.test.utils import override_settings
+from django.utils.module_loading import import_string
+
+from core import metrics
+
+_missing = object()
+RESULTS = {'hits': 'hit', 'misses': 'miss'}
+# Как в LocMemCache: django.core.cache.caches создаёт бэкенд на каждый
+# поток, а L1 и статистика должны быть общими для процесса.
+_entries = {}
+_stats = {}
+_locks = {}
+# Записи в файловый кэш всех его экземпляров процесса.
+_writes = itertools.count()
+
+
+class TieredCache(BaseCache):
+    """``LOCATION`` — псевдоним общего кэша в CACHES.
+
+    OPTIONS: MAX_ENTRIES — размер L1, L1_TIMEOUT — сколько секунд
+    запись живёт в L1, L2_ONLY — префиксы ключей, минующих L1.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.shared = location
+        self.l1_timeout = options.get('L1_TIMEOUT', 5)
+        self.l2_only = tuple(options.get('L2_ONLY', ('generation:',)))
+        self._l1 = _entries.setdefault(location, OrderedDict())
+        self._lock = _locks.setdefault(location, threading.Lock())
+        self._stats = _stats.setdefault(location, dict.fromkeys(
+            ('l1_hits', 'l1_misses', 'l2_hits', 'l2_misses'), 0))
+
+    @property
+    def l2(self):
+        return caches[self.shared]
+
+    def _count(self, name, number=1):
+        with self._lock:
+            self._stats[name] += number
+        tier, result = name.split('_')
+        metrics.count_cache(tier, RESULTS[result], number)
+
+    def stats(self):
+        """Попадания и промахи по уровням с запуска процесса."""
+        with self._lock:
+            stats = dict(self._stats)
+            entries = len(self._l1)
+        return {
+            'l1': {'hits': stats['l1_hits'], 'misses': stats['l1_misses'],
+                   'entries': entries},
+            'l2': {'hits': stats['l2_hits'], 'misses': stats['l2_misses']},
+        }
+
+    def _local(self, key):
+        return not key.startswith(self.l2_only)
+
+    def _l1_get(self, key, version):
+        with self._lock:
+            entry = self._l1.get((key, version))
+            if entry is None:
+                return _missing
+            pickled, expires = entry
+            if expires <= time.monotonic():
+                del self._l1[(key, version)]
+                return _missing
+            self._l1.move_to_end((key, version))
+        # Копия на каждое чтение, как в LocMemCache: ответы и списки
+        # не должны меняться у соседних потоков.
+        return pickle.loads(pickled)
+
+    def _l1_set(self, key, value, timeout, version):
+        if not self._local(key):
+            return
+        lifetime = self.l1_timeout
+        if timeout is not DEFAULT_TIMEOUT and timeout is not None:
+            lifetime = min(lifetime, timeout)
+        if lifetime <= 0:
+            self._l1_delete(key, version)
+            return
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._l1[(key, version)] = (pickled,
+                                        time.monotonic() + lifetime)
+            self._l1.move_to_end((key, version))
+            while len(self._l1) > self._max_entries:
+                self._l1.popitem(last=False)
+
+    def _l1_delete(self, key, version):
+        with self._lock:
+            self._l1.pop((key, version), None)
+
+    def get(self, key, default=None, version=None):
+        if self._local(key):
+            value = self._l1_get(key, version)
+            if value is not _missing:
+                self._count('l1_hits')
+                return value
+            self._count('l1_misses')
+        value = self.l2.get(key, _missing, version=version)
+        if value is _missing:
+            self._count('l2_misses')
+            return default
+        self._count('l2_hits')
+        self._l1_set(key, value, DEFAULT_TIMEOUT, version)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        rest = []
+        for key in keys:
+            value = (self._l1_get(key, version) if self._local(key)
+                     else _missing)
+            if value is _missing:
+                rest.append(key)
+            else:
+                found[key] = value
+        local = sum(1 for key in rest if self._local(key))
+        self._count('l1_hits', len(found))
+        self._count('l1_misses', local)
+        if rest:
+            shared = self.l2.get_many(rest, version=version)
+            self._count('l2_hits', len(shared))
+            self._count('l2_misses', len(rest) - len(shared))
+            for key, value in shared.items():
+                self._l1_set(key, value, DEFAULT_TIMEOUT, version)
+            found.update(shared)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.l2.set(key, value, timeout, version=version)
+        self._l1_set(key, value, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.l2.set_many(data, timeout, version=version) or []
+        for key, value in data.items():
+            if key not in failed:
+                self._l1_set(key, value, timeout, version)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if self.l2.add(key, value, timeout, version=version):
+            self._l1_set(key, value, timeout, version)
+            return True
+        # В L2 уже есть чужое значение: локальная копия могла устареть.
+        self._l1_delete(key, version)
+        return False
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.l2.touch(key, timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self._l1_delete(key, version)
+        return self.l2.incr(key, delta, version=version)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _missing, version=version) is not _missing
+
+    def delete(self, key, version=None):
+        self._l1_delete(key, version)
+        return self.l2.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._l1_delete(key, version)
+        self.l2.delete_many(keys, version=version)
+
+    def clear(self):
+        with self._lock:
+            self._l1.clear()
+        self.l2.clear()
+
+
+class FileCache(FileBasedCache):
+    """FileBasedCache с атомарным add и редким обходом каталога.
+
+    У FileBasedCache add — это has_key() и затем set(), и из
+    параллельных add одного ключа успешны бывают несколько. Здесь add
+    проверяет и пишет ключ под блокировкой файла (flock), поэтому успешен
+    ровно один из потоков и процессов: на этом держатся блокировки
+    core.singleflight.
+
+    FileBasedCache перед каждым set() перечисляет все файлы каталога,
+    чтобы решить, не пора ли чистить: запись стоит O(записей). Здесь
+    проверка идёт раз в CULL_EVERY записей процесса, и кэш может
+    ненадолго превысить MAX_ENTRIES.
+    """
+
+    def __init__(self, dir, params):
+        super().__init__(dir, params)
+        options = params.get('OPTIONS', {})
+        self._cull_every = max(int(options.get('CULL_EVERY', 1000)), 1)
+
+    def _lock_file(self, fname):
+        # 256 файлов блокировок на весь кэш, а не по файлу на ключ.
+        return os.path.join(self._dir, os.path.basename(fname)[:2] + '.lock')
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._createdir()
+        fname = self._key_to_file(key, version)
+        with open(self._lock_file(fname), 'ab') as lock:
+            locks.lock(lock, locks.LOCK_EX)
+            try:
+                if self.has_key(key, version):
+                    return False
+                self.set(key, value, timeout, version)
+                return True
+            finally:
+                locks.unlock(lock)
+
+    def _is_expired(self, f):
+        # Просроченный файл не удаляется при чтении: пока он был открыт,
+        # add мог положить на его место новый, и удалён был бы новый.
+        # Просроченные записи перезаписываются или уходят при чистке.
+        try:
+            expires = pickle.load(f)
+        except EOFError:
+            return True
+        return expires is not None and expires < time.time()
+
+    def _cull(self):
+        if next(_writes) % self._cull_every == 0:
+            super()._cull()
+
+
+def _locmem(location):
+    return {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': location, 'OPTIONS': {'MAX_ENTRIES': 100000}}
+
+
+@contextmanager
+def isolated():
+    """Свои кэши в памяти процесса вместо настроенных на время блока.
+
+    Для инструментов, которые чистят кэш или работают с другой базой
+    (замеры, временная база): общий кэш сайта они не трогают.
+    TieredCache остаётся двухуровневым, но со своими L1 и L2, чтобы
+    замеры с тёплым кэшем шли через оба уровня. override_settings
+    сбрасывает django.core.cache.caches на входе и на выходе.
+    """
+    prefix = f'isolated-{uuid.uuid4().hex}'
+    backends = {}
+    for alias, params in settings.CACHES.items():
+        if issubclass(import_string(params['BACKEND']), TieredCache):
+            shared = f'{prefix}-{params["LOCATION"]}'
+            backends[alias] = {**params, 'LOCATION': shared}
+            backends[shared] = _locmem(shared)
+        else:
+            backends[alias] = _locmem(f'{prefix}-{alias}')
+    with override_settings(CACHES=backends):
+        yield
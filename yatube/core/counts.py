@@ -0,0 +1,69 @@
+"""Закэшированные COUNT(*) для нумерованных страниц.
+
+Значение считается свежим COUNT_CACHE_TIMEOUT секунд. Устаревшее
+отдаётся сразу, а пересчёт уходит в общий пул из COUNT_WORKERS
+потоков, так что COUNT(*) по большой таблице не попадает в время
+ответа. Один и тот же счётчик в пул повторно не ставится.
+"""
+import logging
+import threading
+import time
+from concurrent import futures
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+_refreshing = set()
+_lock = threading.Lock()
+_executor = None
+
+
+def cache_key(name):
+    return f'counts:{name}'
+
+
+def store(name, value):
+    # Запись живёт дольше срока свежести: устаревшее значение нужно,
+    # чтобы было что отдать, пока идёт пересчёт.
+    cache.set(cache_key(name),
+              (value, time.time() + settings.COUNT_CACHE_TIMEOUT),
+              settings.COUNT_CACHE_TIMEOUT * 10)
+    return value
+
+
+def _refresh(name, queryset):
+    try:
+        store(name, queryset.count())
+    except Exception:
+        logger.exception('Не удалось пересчитать %s', name)
+    finally:
+        connection.close()
+        with _lock:
+            _refreshing.discard(name)
+
+
+def refresh_in_background(name, queryset):
+    global _executor
+    with _lock:
+        if name in _refreshing:
+            return
+        _refreshing.add(name)
+        if _executor is None:
+            _executor = futures.ThreadPoolExecutor(
+                max_workers=settings.COUNT_WORKERS,
+                thread_name_prefix='counts')
+        _executor.submit(_refresh, name, queryset)
+
+
+def cached_count(name, queryset):
+    """Число строк queryset: из кэша, при промахе — синхронно."""
+    entry = cache.get(cache_key(name))
+    if entry is None:
+        return store(name, queryset.count())
+    value, fresh_until = entry
+    if time.time() > fresh_until:
+        refresh_in_background(name, queryset)
+    return value
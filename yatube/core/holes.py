@@ -0,0 +1,55 @@
+"""Личные фрагменты в общих закэшированных страницах (hole punching).
+
+Страница кэшируется одна на всех: вместо фрагментов, зависящих от
+пользователя (шапка, кнопки, форма комментария), тег ``{% hole %}``
+оставляет в ней метку. HolePunchMiddleware при каждом ответе заменяет
+метки фрагментами, отрендеренными для текущего запроса.
+
+Подделать метку в тексте поста нельзя: пользовательский ввод
+экранируется, и ``<!--`` до ответа не доходит.
+"""
+import base64
+import json
+import re
+
+from django.template.loader import render_to_string
+
+PATTERN = re.compile(rb'<!--hole:([A-Za-z0-9+/=]+)-->')
+
+
+def placeholder(template_name, context):
+    """Метка фрагмента: шаблон и его контекст в JSON."""
+    data = json.dumps({'t': template_name, 'c': context},
+                      separators=(',', ':'))
+    return f'<!--hole:{base64.b64encode(data.encode()).decode()}-->'
+
+
+def punch(request, content):
+    """content с метками, заменёнными фрагментами для request."""
+    def fragment(match):
+        data = json.loads(base64.b64decode(match.group(1)))
+        return render_to_string(data['t'], data['c'],
+                                request=request).encode()
+    return PATTERN.sub(fragment, content)
+
+
+class HolePunchMiddleware:
+    """Подставляет личные фрагменты в HTML-ответы, в том числе из кэша.
+
+    Стоит ниже CsrfViewMiddleware: фрагмент с формой ставит CSRF-cookie.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (response.streaming
+                or not response.get('Content-Type', '').startswith(
+                    'text/html')
+                or b'<!--hole:' not in response.content):
+            return response
+        response.content = punch(request, response.content)
+        if response.has_header('Content-Length'):
+            response['Content-Length'] = len(response.content)
+        return response
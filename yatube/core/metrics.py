@@ -0,0 +1,217 @@
+"""Время запроса по частям: Server-Timing и метрики для Prometheus.
+
+MetricsMiddleware на время запроса заводит Timings. Туда пишут
+обёртка execute_wrapper (запросы к БД), TimedDjangoTemplates (рендер
+шаблонов), timer('thumbnail') (миниатюры) и TieredCache (попадания и
+промахи кэша). Итог уходит в заголовок Server-Timing и копится по
+имени URL в REGISTRY, который отдаёт view metrics.
+
+Метрики живут в памяти процесса: у каждого воркера свои, как у
+prometheus_client без multiprocess-режима.
+"""
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import (DjangoTemplates, Template,
+                                             reraise)
+
+# Границы корзин гистограмм в секундах, как в prometheus_client.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Части запроса: имя в Server-Timing и в метриках.
+PARTS = (('db', 'db'), ('tpl', 'template'), ('thumb', 'thumbnail'))
+
+_local = threading.local()
+
+
+class Timings:
+    """Время частей одного запроса."""
+
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.queries = 0
+        self.cache = defaultdict(int)
+        self.active = set()
+
+    def execute(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.durations['db'] += time.perf_counter() - started
+            self.queries += 1
+
+    def header(self, total):
+        entries = [f'total;dur={total * 1000:.1f}']
+        for short, name in PARTS:
+            if name in self.durations:
+                entry = f'{short};dur={self.durations[name] * 1000:.1f}'
+                if name == 'db':
+                    entry += f';desc="{self.queries} queries"'
+                entries.append(entry)
+        for tier in sorted({tier for tier, _ in self.cache}):
+            entries.append(f'cache-{tier};desc="hit={self.cache[tier, "hit"]}'
+                           f' miss={self.cache[tier, "miss"]}"')
+        return ', '.join(entries)
+
+
+def current():
+    return getattr(_local, 'timings', None)
+
+
+@contextmanager
+def timer(name):
+    """Добавляет время блока к части name; вложенные блоки не считаются
+    дважды (шаблон карточки внутри шаблона страницы)."""
+    timings = current()
+    if timings is None or name in timings.active:
+        yield
+        return
+    timings.active.add(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.durations[name] += time.perf_counter() - started
+        timings.active.discard(name)
+
+
+def count_cache(tier, result, number=1):
+    timings = current()
+    if timings is not None and number:
+        timings.cache[tier, result] += number
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        with timer('template'):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Бэкенд шаблонов Django, который замеряет рендер."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name),
+                                 self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[index] += 1
+
+
+class Registry:
+    """Метрики по имени URL с запуска процесса."""
+
+    HISTOGRAMS = (
+        ('yatube_request_duration_seconds', 'Время ответа.'),
+        ('yatube_db_duration_seconds', 'Время запросов к БД.'),
+        ('yatube_template_duration_seconds', 'Время рендера шаблонов.'),
+        ('yatube_thumbnail_duration_seconds', 'Время работы с миниатюрами.'),
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = defaultdict(Histogram)
+        self.counters = defaultdict(int)
+
+    def observe(self, view, status, total, timings):
+        values = (total, timings.durations['db'],
+                  timings.durations['template'],
+                  timings.durations['thumbnail'])
+        with self._lock:
+            for (name, _), value in zip(self.HISTOGRAMS, values):
+                self.histograms[name, view].observe(value)
+            self.counters['yatube_requests_total', (
+                ('view', view), ('status', str(status)))] += 1
+            self.counters['yatube_db_queries_total', (
+                ('view', view),)] += timings.queries
+            for (tier, result), number in timings.cache.items():
+                self.counters['yatube_cache_requests_total', (
+                    ('view', view), ('tier', tier),
+                    ('result', result))] += number
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus 0.0.4."""
+        lines = []
+        with self._lock:
+            for name, help_text in self.HISTOGRAMS:
+                lines += [f'# HELP {name} {help_text}',
+                          f'# TYPE {name} histogram']
+                for (metric, view), histogram in sorted(
+                        self.histograms.items()):
+                    if metric == name:
+                        lines += self._histogram(name, view, histogram)
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f'# TYPE {name} counter')
+                for (metric, labels), value in sorted(
+                        self.counters.items()):
+                    if metric == name:
+                        lines.append(f'{name}{{{_labels(labels)}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def _histogram(self, name, view, histogram):
+        labels = _labels((('view', view),))
+        for bound, count in zip(BUCKETS, histogram.buckets):
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {count}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}'
+        yield f'{name}_sum{{{labels}}} {histogram.sum:.6f}'
+        yield f'{name}_count{{{labels}}} {histogram.count}'
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+def _labels(pairs):
+    return ','.join('{}="{}"'.format(
+        key, value.replace('\\', '\\\\').replace('"', '\\"'))
+        for key, value in pairs)
+
+
+REGISTRY = Registry()
+
+
+class MetricsMiddleware:
+    """Первый в MIDDLEWARE: замеряет весь запрос."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = _local.timings = Timings()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(timings.execute))
+                response = self.get_response(request)
+        finally:
+            _local.timings = None
+        total = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        REGISTRY.observe(view, response.status_code, total, timings)
+        response['Server-Timing'] = timings.header(total)
+        return response
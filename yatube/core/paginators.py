@@ -0,0 +1,184 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+def _json_default(value):
+    # DjangoJSONEncoder обрезает микросекунды, а курсору нужна точность.
+    return value.isoformat()
+
+
+class CursorPaginator(Paginator):
+    """Пагинатор по ключу (keyset) вместо OFFSET.
+
+    Страница выбирается условием по полям сортировки относительно
+    курсора, поэтому её стоимость не зависит от глубины и не требует
+    COUNT(*). Нумерованные страницы (``get_page``) работают как раньше,
+    но число объектов можно передать готовым (``count``), а ссылки на
+    страницы выводятся окном (``page_links``), а не всем диапазоном.
+    """
+
+    ELLIPSIS = '…'
+
+    def __init__(self, object_list, per_page,
+                 ordering=('-pub_date', '-pk'), count=None, **kwargs):
+        super().__init__(object_list.order_by(*ordering), per_page, **kwargs)
+        self.ordering = ordering
+        self._count = count
+
+    @cached_property
+    def count(self):
+        """Число объектов; count из конструктора избавляет от COUNT(*).
+
+        Может быть числом или функцией, которая вызовется, только если
+        понадобятся нумерованные страницы.
+        """
+        if self._count is None:
+            return super().count
+        if callable(self._count):
+            return self._count()
+        return self._count
+
+    def elided_page_range(self, number, on_each_side=2, on_ends=1):
+        """Номера страниц вокруг number и по краям, пропуски — ELLIPSIS."""
+        number = self.validate_number(number)
+        if self.num_pages <= (on_each_side + on_ends) * 2 + 1:
+            yield from self.page_range
+            return
+        if number > 1 + on_each_side + on_ends + 1:
+            yield from range(1, on_ends + 1)
+            yield self.ELLIPSIS
+            start = number - on_each_side
+        else:
+            start = 1
+        if number < self.num_pages - on_each_side - on_ends - 1:
+            yield from range(start, number + on_each_side + 1)
+            yield self.ELLIPSIS
+            yield from range(self.num_pages - on_ends + 1,
+                             self.num_pages + 1)
+        else:
+            yield from range(start, self.num_pages + 1)
+
+    def page(self, number):
+        # Число может быть приблизительным, поэтому срез не обрезается
+        # по count: строки, добавленные после подсчёта, не теряются.
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        return self._get_page(
+            self.object_list[bottom:bottom + self.per_page], number, self)
+
+    def _fields(self):
+        model = self.object_list.model
+        for name in self.ordering:
+            name = name.lstrip('-')
+            if name == 'pk':
+                yield name, model._meta.pk
+            else:
+                yield name, model._meta.get_field(name)
+
+    def _position(self, obj):
+        # Строки .values() — словари, остальные — объекты моделей.
+        if isinstance(obj, dict):
+            return [obj[name] for name, _ in self._fields()]
+        return [getattr(obj, name) for name, _ in self._fields()]
+
+    def encode_cursor(self, obj, reverse=False):
+        data = {'p': self._position(obj), 'r': int(reverse)}
+        raw = json.dumps(data, default=_json_default).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """Возвращает (позиция, reverse) или None для битого курсора."""
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            data = json.loads(raw.decode())
+            position = [field.to_python(value) for (_, field), value
+                        in zip(self._fields(), data['p'])]
+            if len(position) != len(self.ordering):
+                return None
+            return position, bool(data['r'])
+        except (ValueError, TypeError, KeyError, AttributeError,
+                ValidationError):
+            return None
+
+    def _window(self, position, reverse, limit):
+        """До limit объектов строго после позиции (None — с начала);
+        с reverse — в обратном порядке, от позиции назад."""
+        queryset = self.object_list
+        if position is not None:
+            queryset = queryset.filter(
+                keyset(self.ordering, position, reverse))
+        if reverse:
+            queryset = queryset.reverse()
+        return list(queryset[:limit])
+
+    def cursor_page(self, cursor=None):
+        """Страница после (или до) курсора без COUNT(*) и OFFSET."""
+        decoded = self.decode_cursor(cursor) if cursor else None
+        position, reverse = decoded if decoded is not None else (None, False)
+        object_list = self._window(position, reverse, self.per_page + 1)
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+        if reverse:
+            object_list.reverse()
+        page = Page(object_list, None, self)
+        page.page_links = []
+        page.cursor = cursor if decoded is not None else ''
+        page.next_cursor = page.previous_cursor = ''
+        if object_list:
+            if has_more or reverse:
+                page.next_cursor = self.encode_cursor(object_list[-1])
+            if decoded is not None and (has_more or not reverse):
+                page.previous_cursor = self.encode_cursor(
+                    object_list[0], reverse=True)
+        return page
+
+    def get_page(self, number):
+        page = super().get_page(number)
+        page.page_links = list(self.elided_page_range(page.number))
+        page.cursor = ''
+        page.next_cursor = page.previous_cursor = ''
+        if page.object_list:
+            if page.has_next():
+                page.next_cursor = self.encode_cursor(page[-1])
+            if page.has_previous():
+                page.previous_cursor = self.encode_cursor(
+                    page[0], reverse=True)
+        return page
+
+
+def keyset(ordering, position, reverse=False):
+    """Условие «строго после позиции» для сортировки ordering."""
+    condition = Q()
+    equal = {}
+    for order, value in zip(ordering, position):
+        name = order.lstrip('-')
+        descending = order.startswith('-') != reverse
+        lookup = '{}__{}'.format(name, 'lt' if descending else 'gt')
+        condition |= Q(**equal, **{lookup: value})
+        equal[name] = value
+    return condition
+
+
+def paginate(request, queryset, per_page, count=None,
+             paginator_class=CursorPaginator, **options):
+    """Страница ленты по ``?cursor=``, а для старых ссылок — по ``?page=``.
+
+    count (число или функция) нужен нумерованным страницам и первой
+    странице: с неё ведут ссылки на нумерованные, иначе до них не дойти
+    из интерфейса. Страницы после курсора своего номера не знают и
+    обходятся без COUNT(*). options передаются paginator_class.
+    """
+    paginator = paginator_class(queryset, per_page, count=count, **options)
+    page_number = request.GET.get('page')
+    if page_number and not request.GET.get('cursor'):
+        return paginator.get_page(page_number)
+    page = paginator.cursor_page(request.GET.get('cursor'))
+    if not page.cursor:
+        page.number = 1
+        page.page_links = list(paginator.elided_page_range(1))
+    return page
@@ -0,0 +1,182 @@
+"""Пересчёт ключа кэша одним запросом из всех параллельных.
+
+Когда запись устаревает, её пересчитывает только тот, кто взял
+блокировку ``lock:<ключ>`` через cache.add. Блокировка держится, только
+если add общего кэша атомарен: так у memcached, Redis и LocMemCache,
+а у файлового кэша — в core.caches.FileCache (у FileBasedCache нет).
+Остальные получают прежнее значение, а если его нет — недолго ждут
+готового.
+
+Заранее запись обновляется вероятностно (XFetch): чем ближе срок и чем
+дольше пересчёт, тем вероятнее, что очередной запрос обновит её до
+истечения, и толпа промахов в одну секунду не возникает.
+"""
+import math
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+_lock = threading.Lock()
+_stats = dict.fromkeys(
+    ('recomputes', 'early_refreshes', 'stale_served', 'waited',
+     'wait_timeouts'), 0)
+
+
+class Entry:
+    """Значение с длительностью пересчёта и сроком годности."""
+
+    __slots__ = ('value', 'delta', 'expires')
+
+    def __init__(self, value, delta, expires):
+        self.value = value
+        self.delta = delta
+        self.expires = expires
+
+    def __getstate__(self):
+        return self.value, self.delta, self.expires
+
+    def __setstate__(self, state):
+        self.value, self.delta, self.expires = state
+
+
+def _count(name, number=1):
+    with _lock:
+        _stats[name] += number
+
+
+def stats():
+    """Пересчёты и «склеенные» запросы с запуска процесса."""
+    with _lock:
+        return dict(_stats)
+
+
+def lock_key(key):
+    return f'lock:{key}'
+
+
+def _entry(found):
+    # Записи прежнего формата считаются промахом.
+    return found if isinstance(found, Entry) else None
+
+
+def refresh_early(entry, beta=None):
+    if entry.expires is None:
+        return False
+    beta = settings.EARLY_REFRESH_BETA if beta is None else beta
+    # log(random()) < 0: запас растёт с длительностью пересчёта.
+    return (time.time() - entry.delta * beta * math.log(random.random())
+            >= entry.expires)
+
+
+def _acquire(key):
+    return cache.add(lock_key(key), True,
+                     settings.SINGLE_FLIGHT_LOCK_TIMEOUT)
+
+
+def _store(key, value, delta, timeout):
+    expires = None if timeout is None else time.time() + timeout
+    cache.set(key, Entry(value, delta, expires), timeout)
+
+
+def _recompute(key, compute, timeout, cacheable, locked=True):
+    try:
+        started = time.monotonic()
+        value = compute()
+        if cacheable is None or cacheable(value):
+            _store(key, value, time.monotonic() - started, timeout)
+        _count('recomputes')
+        return value
+    finally:
+        if locked:
+            cache.delete(lock_key(key))
+
+
+def _wait(keys, fresh):
+    """Ждёт, пока ключи пересчитает держатель блокировки.
+
+    Ключ без значения и без блокировки больше не ждётся: держатель
+    закончил, но значение хранить нельзя (например, ответ 404).
+    """
+    found = {}
+    deadline = time.monotonic() + settings.SINGLE_FLIGHT_WAIT
+    while keys and time.monotonic() < deadline:
+        time.sleep(0.02)
+        entries = cache.get_many(keys + [lock_key(key) for key in keys])
+        for key in keys:
+            entry = _entry(entries.get(key))
+            if entry is not None and (fresh is None or fresh(entry.value)):
+                found[key] = entry.value
+        keys = [key for key in keys
+                if key not in found and lock_key(key) in entries]
+    _count('waited', len(found))
+    _count('wait_timeouts', len(keys))
+    return found
+
+
+def fetch(key, compute, timeout, fresh=None, cacheable=None):
+    """Значение из кэша или compute(), но не больше одного пересчёта.
+
+    fresh(value) сообщает, не устарело ли значение раньше срока
+    (например, по поколениям); cacheable(value) — можно ли его хранить.
+    """
+    entry = _entry(cache.get(key))
+    if entry is not None:
+        stale = fresh is not None and not fresh(entry.value)
+        if not stale and not refresh_early(entry):
+            return entry.value
+        if _acquire(key):
+            if not stale:
+                _count('early_refreshes')
+            return _recompute(key, compute, timeout, cacheable)
+        _count('stale_served')
+        return entry.value
+    if _acquire(key):
+        return _recompute(key, compute, timeout, cacheable)
+    found = _wait([key], fresh)
+    if key in found:
+        return found[key]
+    return _recompute(key, compute, timeout, cacheable, locked=False)
+
+
+def fetch_many(keys, compute_many, timeout):
+    """Как fetch для набора ключей: compute_many(keys) -> {ключ: значение}.
+
+    Без раннего обновления: так кэшируются фрагменты, ключ которых
+    меняется вместе с содержимым. Недостающие ключи, которые уже
+    пересчитывает кто-то другой, ждутся; не дождавшись, запрос считает
+    их сам.
+    """
+    entries = cache.get_many(keys)
+    found = {}
+    missing = []
+    for key in keys:
+        entry = _entry(entries.get(key))
+        if entry is not None:
+            found[key] = entry.value
+        else:
+            missing.append(key)
+    if not missing:
+        return found
+    ours = [key for key in missing if _acquire(key)]
+    theirs = [key for key in missing if key not in ours]
+    try:
+        if ours:
+            started = time.monotonic()
+            computed = compute_many(ours)
+            delta = (time.monotonic() - started) / len(ours)
+            expires = None if timeout is None else time.time() + timeout
+            cache.set_many({key: Entry(value, delta, expires)
+                            for key, value in computed.items()}, timeout)
+            _count('recomputes', len(ours))
+            found.update(computed)
+    finally:
+        cache.delete_many([lock_key(key) for key in ours])
+    if theirs:
+        found.update(_wait(theirs, None))
+        rest = [key for key in theirs if key not in found]
+        if rest:
+            found.update(compute_many(rest))
+    return found
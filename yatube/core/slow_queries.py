@@ -0,0 +1,190 @@
+"""Журнал медленных запросов к БД с указанием view и шаблона.
+
+Обёртка execute_wrapper ставится на каждое новое соединение, так что
+видит запросы из view, шаблонов, фоновых потоков и команд. Запрос
+дольше SLOW_QUERY_THRESHOLD_MS пишется строкой JSON в логгер
+``yatube.slow_queries`` (в settings — файл, который ротирует
+logrotate): SQL без значений, длительность, имя URL, строки кода
+проекта и узел шаблона, из-за которого он выполнился, например
+``includes/post_card.html:7 {{ post.author.get_full_name }}``.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.template.base import Node
+from django.utils import timezone
+
+logger = logging.getLogger('yatube.slow_queries')
+
+_local = threading.local()
+# Сколько строк кода проекта сохранять, от ближайшей к запросу.
+STACK_DEPTH = 8
+NORMALIZERS = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%s'), '?'),
+    # IN (?, ?, ?) с разным числом значений — один и тот же запрос.
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)'), '(?, ...)'),
+    (re.compile(r'\s+'), ' '),
+)
+
+
+def normalize(sql):
+    for pattern, replacement in NORMALIZERS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def fingerprint(sql):
+    return hashlib.md5(sql.encode()).hexdigest()[:12]
+
+
+def _project_frame(filename):
+    return (filename.startswith(settings.BASE_DIR)
+            and filename != __file__
+            and 'site-packages' not in filename)
+
+
+def attribution(frame):
+    """(строки кода проекта, узел шаблона) для кадра, где выполнен запрос."""
+    stack = []
+    template = None
+    while frame is not None:
+        code = frame.f_code
+        node = frame.f_locals.get('self')
+        # type(), а не isinstance(): isinstance вычислил бы ленивый
+        # объект (request.user) и выполнил бы ещё один запрос.
+        if (template is None and issubclass(type(node), Node)
+                and getattr(node, 'token', None) is not None
+                and getattr(node, 'origin', None) is not None):
+            template = '{}:{} {}'.format(
+                node.origin.template_name, node.token.lineno,
+                _token_text(node.token))
+        if (len(stack) < STACK_DEPTH
+                and _project_frame(code.co_filename)):
+            stack.append('{}:{} in {}'.format(
+                os.path.relpath(code.co_filename, settings.BASE_DIR),
+                frame.f_lineno, code.co_name))
+        frame = frame.f_back
+    return stack, template
+
+
+def _token_text(token):
+    if token.token_type.name == 'VAR':
+        return '{{ %s }}' % token.contents
+    return '{%% %s %%}' % token.contents
+
+
+def _view_name():
+    request = getattr(_local, 'request', None)
+    match = getattr(request, 'resolver_match', None)
+    if match is not None:
+        return match.view_name, request.path
+    if request is not None:
+        return 'unmatched', request.path
+    return None, None
+
+
+def record(sql, duration, frame):
+    normalized = normalize(sql)
+    stack, template = attribution(frame)
+    view, path = _view_name()
+    logger.warning(json.dumps({
+        'time': timezone.now().isoformat(),
+        'duration_ms': round(duration * 1000, 3),
+        'fingerprint': fingerprint(normalized),
+        'sql': normalized,
+        'view': view,
+        'path': path,
+        'template': template,
+        'stack': stack,
+    }, ensure_ascii=False))
+
+
+def wrapper(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        if duration * 1000 >= settings.SLOW_QUERY_THRESHOLD_MS:
+            record(sql, duration, sys._getframe(1))
+
+
+def install(sender, connection, **kwargs):
+    """Обработчик connection_created: вешает обёртку на соединение."""
+    if wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(wrapper)
+
+
+class SlowQueryMiddleware:
+    """Запоминает текущий запрос, чтобы приписать SQL к его view."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _local.request = request
+        try:
+            return self.get_response(request)
+        finally:
+            _local.request = None
+
+
+def read(paths):
+    """Записи журнала из файлов (включая ротированные .1, .2, ...)."""
+    for path in paths:
+        with open(path, encoding='utf-8') as stream:
+            for line in stream:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def log_files(path):
+    """Основной файл журнала и его ротированные копии, от старых к новым."""
+    rotated = []
+    directory, name = os.path.split(path)
+    if os.path.isdir(directory or '.'):
+        for entry in os.listdir(directory or '.'):
+            suffix = entry[len(name) + 1:]
+            if entry.startswith(name + '.') and suffix.isdigit():
+                rotated.append((int(suffix), os.path.join(directory, entry)))
+    files = [file for _, file in sorted(rotated, reverse=True)]
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def summarize(records, by='fingerprint', top=20):
+    """Худшие группы записей по суммарному времени."""
+    groups = {}
+    for entry in records:
+        key = entry.get(by) or '-'
+        group = groups.setdefault(key, {
+            by: key, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+            'sql': entry['sql'], 'views': {}, 'templates': {},
+        })
+        group['count'] += 1
+        group['total_ms'] += entry['duration_ms']
+        group['max_ms'] = max(group['max_ms'], entry['duration_ms'])
+        for field, counts in (('view', group['views']),
+                              ('template', group['templates'])):
+            if entry.get(field):
+                counts[entry[field]] = counts.get(entry[field], 0) + 1
+    ranked = sorted(groups.values(), key=lambda group: -group['total_ms'])
+    for group in ranked:
+        group['total_ms'] = round(group['total_ms'], 3)
+        group['mean_ms'] = round(group['total_ms'] / group['count'], 3)
+    return ranked[:top]
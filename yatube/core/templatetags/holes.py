@@ -0,0 +1,15 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from core import holes
+
+register = template.Library()
+
+
+@register.simple_tag
+def hole(template_name, **context):
+    """Место для личного фрагмента; context должен сериализоваться в JSON.
+
+    `{% hole 'posts/includes/follow_button.html' author_id=profile.pk %}`
+    """
+    return mark_safe(holes.placeholder(template_name, context))
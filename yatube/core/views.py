@@ -1,5 +1,11 @@
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import render
 
+from . import metrics as timing
+
 
 def page_not_found(request, exception):
     return render(request, 'core/404.html', {'path': request.path}, status=404)
@@ -15,3 +21,22 @@ def server_error(request):
 
 def permission_denied(request, exception):
     return render(request, 'core/403.html', status=403)
+
+
+def metrics(request):
+    """Метрики процесса в текстовом формате Prometheus.
+
+    Открыты при DEBUG и сотрудникам, остальным — только с заголовком
+    ``Authorization: Bearer <METRICS_TOKEN>``. Без токена в настройках
+    Prometheus их не получит.
+    """
+    token = settings.METRICS_TOKEN
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    allowed = (settings.DEBUG or request.user.is_staff
+               or token and hmac.compare_digest(header.encode(),
+                                                f'Bearer {token}'.encode()))
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(timing.REGISTRY.render(),
+                        content_type='text/plain; version=0.0.4; '
+                                     'charset=utf-8')
@@ -1,5 +1,6 @@
 from django.contrib import admin
 from .models import Post, Group, Comment, Follow
+from . import search
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -11,10 +12,27 @@ class PostAdmin(admin.ModelAdmin):
         'group',
     )
     list_editable = ('group',)
+    list_select_related = ('author', 'group')
     search_fields = ('text',)
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return search.filter_posts(queryset, search_term), False
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        field = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        if db_field.name == 'group' and request is not None:
+            # Список групп для list_editable читается один раз на страницу,
+            # а не для каждой строки.
+            choices = getattr(request, '_group_choices', None)
+            if choices is None:
+                choices = request._group_choices = list(field.choices)
+            field.choices = choices
+        return field
+
 
 class GroupAdmin(admin.ModelAdmin):
     list_display = (
@@ -35,6 +53,7 @@ class CommentAdmin(admin.ModelAdmin):
         'created',
         'author',
     )
+    list_select_related = ('post', 'author')
     search_fields = ('text',)
     list_filter = ('post', 'author', 'created')
     empty_value_display = '-пусто-'
@@ -42,6 +61,7 @@ class CommentAdmin(admin.ModelAdmin):
 
 class FollowAdmin(admin.ModelAdmin):
     list_display = ("user", "author")
+    list_select_related = ("user", "author")
     list_filter = ("user", "author")
 
 
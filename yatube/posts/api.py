@@ -0,0 +1,192 @@
+"""Read-only JSON API лент, постов, профилей и групп.
+
+Ответы собираются из .values() — только нужные поля, без моделей — и
+кэшируются так же, как HTML-страницы: по поколениям данных.
+"""
+from functools import wraps
+
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+
+from core.paginators import CursorPaginator
+
+from . import objects, timelines
+from .caching import cache_page_by_generation
+from .counters import get_counters
+from .models import Comment, Group, Post, User
+from .views import (comments_generations, group_generations,
+                    index_generations, post_generations, profile_generations)
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 100
+COMMENTS_LIMIT = 20
+# Имя поля в ответе -> поле для .values().
+FEED_FIELDS = {
+    'id': 'pk',
+    'text': 'text',
+    'pub_date': 'pub_date',
+    'modified': 'modified',
+    'author': 'author__username',
+    'group': 'group__slug',
+    'image': 'image',
+}
+# Комментарий сбрасывает только поколение своего поста, поэтому число
+# комментариев отдаёт страница поста, а не ленты.
+POST_FIELDS = {**FEED_FIELDS, 'comments_count': 'comments_count'}
+COMMENT_FIELDS = {
+    'id': 'pk',
+    'author': 'author__username',
+    'text': 'text',
+    'created': 'created',
+}
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def json_response(data, status=200):
+    return JsonResponse(data, status=status, encoder=DjangoJSONEncoder,
+                        json_dumps_params={'ensure_ascii': False,
+                                           'separators': (',', ':')})
+
+
+def api_view(view):
+    """Ошибки API, включая 404, отдаются как JSON."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except ApiError as error:
+            return json_response({'error': str(error)}, error.status)
+        except Http404:
+            return json_response({'error': 'Не найдено.'}, 404)
+    return wrapper
+
+
+def selected_fields(request, available):
+    """Поля из ?fields=a,b; по умолчанию — все."""
+    requested = request.GET.get('fields')
+    if not requested:
+        return list(available)
+    fields = [field for field in requested.split(',') if field]
+    unknown = [field for field in fields if field not in available]
+    if unknown:
+        raise ApiError(f'Неизвестные поля: {", ".join(unknown)}.')
+    return fields
+
+
+def limit(request):
+    try:
+        value = int(request.GET.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise ApiError('limit должен быть числом.')
+    return min(max(value, 1), MAX_LIMIT)
+
+
+def project(rows, fields, available):
+    result = []
+    for row in rows:
+        item = {field: row[available[field]] for field in fields}
+        if 'image' in item:
+            item['image'] = (default_storage.url(item['image'])
+                             if item['image'] else None)
+        result.append(item)
+    return result
+
+
+def page(queryset, available, fields, ordering, cursor, per_page,
+         paginator_class=CursorPaginator, **options):
+    """Страница проекции по курсору и курсоры соседних страниц.
+
+    options передаются paginator_class.
+    """
+    # Поля сортировки нужны курсору, даже если их не просили.
+    columns = {available[field] for field in fields} | {
+        name.lstrip('-') for name in ordering}
+    paginator = paginator_class(queryset.values(*columns), per_page,
+                                ordering=ordering, **options)
+    result = paginator.cursor_page(cursor)
+    return {
+        'results': project(result, fields, available),
+        'next': result.next_cursor or None,
+        'previous': result.previous_cursor or None,
+    }
+
+
+def posts_page(request, queryset, **options):
+    return page(queryset, FEED_FIELDS, selected_fields(request, FEED_FIELDS),
+                ('-pub_date', '-pk'), request.GET.get('cursor'),
+                limit(request), **options)
+
+
+def comments_page(post_id, cursor=None):
+    return page(Comment.objects.filter(post=post_id), COMMENT_FIELDS,
+                list(COMMENT_FIELDS), ('created', 'pk'), cursor,
+                COMMENTS_LIMIT)
+
+
+@api_view
+@cache_page_by_generation(index_generations)
+def index(request):
+    return json_response(posts_page(request, Post.objects.all()))
+
+
+@api_view
+@cache_page_by_generation(group_generations)
+def group_posts(request, slug):
+    group = objects.get_or_404(Group, slug=slug)
+    data = posts_page(request, group.posts_group.all())
+    data['group'] = {'title': group.title, 'slug': group.slug,
+                     'description': group.description}
+    return json_response(data)
+
+
+@api_view
+@cache_page_by_generation(profile_generations)
+def profile(request, username):
+    profile = objects.get_or_404(User, username=username)
+    counters = get_counters(profile)
+    data = posts_page(request, profile.posts_author.all())
+    data['profile'] = {
+        'username': profile.username,
+        'full_name': profile.get_full_name(),
+        'posts': counters.posts,
+        'followers': counters.followers,
+        'following': counters.following,
+    }
+    return json_response(data)
+
+
+@api_view
+@cache_page_by_generation(post_generations)
+def post_detail(request, post_id):
+    fields = selected_fields(request, POST_FIELDS)
+    columns = {POST_FIELDS[field] for field in fields}
+    post = get_object_or_404(Post.objects.values(*columns), pk=post_id)
+    data = project([post], fields, POST_FIELDS)[0]
+    comments = comments_page(post_id)
+    data['comments'] = comments['results']
+    data['comments_next'] = comments['next']
+    return json_response(data)
+
+
+@api_view
+@cache_page_by_generation(comments_generations)
+def post_comments(request, post_id):
+    objects.get_or_404(Post, post_id)
+    data = comments_page(post_id, request.GET.get('cursor'))
+    return json_response(data)
+
+
+@api_view
+def follow_index(request):
+    if not request.user.is_authenticated:
+        raise ApiError('Нужна авторизация.', 401)
+    return json_response(posts_page(
+        request, Post.objects.all(), paginator_class=timelines.FeedPaginator,
+        user=request.user))
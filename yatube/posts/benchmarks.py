@@ -0,0 +1,145 @@
+"""Замеры страниц posts через тестовый клиент Django.
+
+Для каждой страницы считаются перцентили времени ответа, число
+запросов к БД, размер ответа и пик выделенной памяти. Результаты
+сравниваются с сохранённым JSON, чтобы ловить регрессии.
+"""
+import math
+import time
+import tracemalloc
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from core import caches
+
+from .models import Post, User, UserCounters
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values, percent):
+    """Перцентиль методом ближайшего ранга."""
+    ordered = sorted(values)
+    # Умножение до деления: 7 / 100 * 100 даёт 7.000000000000001.
+    rank = max(math.ceil(percent * len(ordered) / 100) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def subjects():
+    """Самые «тяжёлые» объекты базы: по ним страницы медленнее всего."""
+    author = User.objects.filter(pk__in=UserCounters.objects.order_by(
+        '-posts').values('pk')[:1]).first()
+    reader = User.objects.filter(pk__in=UserCounters.objects.order_by(
+        '-following').values('pk')[:1]).first()
+    post = Post.objects.filter(author=author).first()
+    grouped = Post.objects.exclude(group=None).order_by('-pk').values_list(
+        'group__slug', flat=True).first()
+    if author is None or post is None:
+        raise ValueError('База пуста: сначала запустите seed_data.')
+    return {'author': author, 'reader': reader or author, 'post': post,
+            'group': grouped, 'word': post.text.split()[0]}
+
+
+def scenarios(found):
+    """(имя, URL, пользователь или None) для каждой читающей страницы.
+
+    post_delete, add_comment и подписки пишут в БД: их повторы меняли бы
+    данные между итерациями, поэтому они здесь не замеряются.
+    """
+    author, post = found['author'], found['post']
+    yield 'index', reverse('posts:index'), None
+    yield ('search', reverse('posts:search') + f'?q={found["word"]}', None)
+    if found['group']:
+        yield ('group_posts', reverse(
+            'posts:group_posts', kwargs={'slug': found['group']}), None)
+    yield ('profile', reverse(
+        'posts:profile', kwargs={'username': author.username}), None)
+    yield ('post_detail', reverse(
+        'posts:post_detail', kwargs={'post_id': post.pk}), None)
+    yield 'follow_index', reverse('posts:follow_index'), found['reader']
+    yield 'post_create', reverse('posts:post_create'), author
+    yield ('post_edit', reverse(
+        'posts:post_edit', kwargs={'post_id': post.pk}), author)
+
+
+def measure(client, url, iterations, warm, warmup=0):
+    """Замер страницы на своём кэше: общий кэш сайта не чистится.
+
+    В результате и попадания по уровням этого кэша, если он их считает.
+    """
+    with caches.isolated():
+        for _ in range(warmup):
+            client.get(url)
+        result = _measure(client, url, iterations, warm)
+        if hasattr(cache, 'stats'):
+            result['cache'] = cache.stats()
+    return result
+
+
+def _measure(client, url, iterations, warm):
+    timings = []
+    for _ in range(iterations):
+        if not warm:
+            cache.clear()
+        started = time.perf_counter()
+        response = client.get(url)
+        timings.append((time.perf_counter() - started) * 1000)
+    if not warm:
+        cache.clear()
+    # Не CaptureQueriesContext: при DEBUG=True сигнал request_started
+    # очищает connection.queries посреди замера.
+    queries = []
+    with connection.execute_wrapper(
+            lambda execute, sql, *args: queries.append(sql)
+            or execute(sql, *args)):
+        client.get(url)
+    if not warm:
+        cache.clear()
+    # tracemalloc замедляет код, поэтому память меряется отдельным
+    # запросом, не попадающим в тайминги.
+    tracemalloc.start()
+    try:
+        client.get(url)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    result = {'url': url, 'status': response.status_code,
+              'queries': len(queries), 'bytes': len(response.content),
+              'peak_kb': round(peak / 1024, 1),
+              'mean_ms': round(sum(timings) / len(timings), 3)}
+    for percent in PERCENTILES:
+        result[f'p{percent}_ms'] = round(percentile(timings, percent), 3)
+    return result
+
+
+def run(iterations=50, warmup=5, warm=False, only=None):
+    results = {}
+    for name, url, user in scenarios(subjects()):
+        if only and name not in only:
+            continue
+        client = Client()
+        if user is not None:
+            client.force_login(user)
+        results[name] = measure(client, url, iterations, warm, warmup)
+    return results
+
+
+def regressions(results, baseline, threshold):
+    """Страницы, ставшие медленнее baseline больше чем на threshold
+    (доля), или делающие больше запросов к БД."""
+    found = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms'):
+            if result[metric] > before[metric] * (1 + threshold):
+                found.append(f'{name}: {metric} {before[metric]} -> '
+                             f'{result[metric]}')
+        if result['queries'] > before['queries']:
+            found.append(f'{name}: queries {before["queries"]} -> '
+                         f'{result["queries"]}')
+    return found
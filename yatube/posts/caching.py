@@ -0,0 +1,164 @@
+import hashlib
+import time
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+
+from core import singleflight
+
+KEY_PREFIX = 'pages'
+# Общее поколение всех страниц и объектов: его смена сбрасывает кэш
+# целиком одной записью (transfer.forget_cached).
+EPOCH = 'epoch'
+
+
+def generation_key(name):
+    return f'generation:{name}'
+
+
+def new_generation():
+    # Время создания в токене даёт Last-Modified без запросов к БД.
+    return f'{time.time():.6f}:{uuid.uuid4().hex}'
+
+
+def _renew(names):
+    cache.set_many(
+        {generation_key(name): new_generation() for name in names}, None)
+
+
+def bump(*names):
+    """Сбрасывает закэшированные страницы, зависящие от names.
+
+    Внутри транзакции поколения сменятся ещё раз после коммита: иначе
+    страница, собранная до коммита из прежних данных, легла бы в кэш
+    под новое поколение.
+    """
+    _renew(names)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _renew(names))
+
+
+def post_generations(post):
+    """Поколения страниц, на которых виден пост."""
+    names = {'posts', f'profile:{post.author_id}', f'post:{post.pk}'}
+    for group_id in (post.group_id, getattr(post, '_loaded_group_id', None)):
+        if group_id is not None:
+            names.add(f'group:{group_id}')
+    return names
+
+
+def generations(names):
+    """Текущие поколения names и EPOCH; отсутствующие заводятся заново."""
+    keys = {generation_key(name): name for name in (*names, EPOCH)}
+    found = cache.get_many(keys)
+    for key in keys.keys() - found.keys():
+        cache.add(key, new_generation(), None)
+        found[key] = cache.get(key)
+    return {keys[key]: value for key, value in found.items()}
+
+
+def epoch():
+    return generations(())[EPOCH]
+
+
+def last_modified(current):
+    """Самое позднее изменение среди поколений, в секундах.
+
+    Поколение, заведённое заново после вытеснения из кэша, моложе
+    настоящего изменения: клиент лишь получит лишнюю полную страницу.
+    """
+    stamps = [float(token.split(':', 1)[0]) for token in current.values()
+              if ':' in token]
+    return int(max(stamps)) if stamps else None
+
+
+def request_parts(request):
+    """Из чего складывается ответ конкретному пользователю (для ETag)."""
+    parts = [request.get_full_path()]
+    if request.user.is_authenticated:
+        # Личные фрагменты содержат CSRF-токен, привязанный к cookie.
+        parts += [str(request.user.pk),
+                  request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')]
+    return parts
+
+
+def page_key(request):
+    """Ключ общий для всех: личное подставляет core.holes после кэша."""
+    digest = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'{KEY_PREFIX}:{request.resolver_match.view_name}:{digest}'
+
+
+def validators(request, current):
+    """ETag и Last-Modified ответа пользователю по поколениям страницы.
+
+    ETag меняется вместе с любым поколением, поэтому правки и удаления
+    его сбрасывают. Залогиненным Last-Modified не отдаётся: страница
+    зависит ещё и от пользователя, а это различает только ETag.
+    """
+    parts = request_parts(request) + [
+        current[name] for name in sorted(current)]
+    etag = quote_etag(hashlib.md5('|'.join(parts).encode()).hexdigest())
+    modified = (None if request.user.is_authenticated
+                else last_modified(current))
+    return etag, modified
+
+
+def with_validators(response, etag, modified):
+    if response.status_code == 200 and not response.streaming:
+        response.setdefault('ETag', etag)
+        if modified is not None:
+            response.setdefault('Last-Modified', http_date(modified))
+    return response
+
+
+def cache_page_by_generation(dependencies):
+    """Кэш страницы, который живёт долго и сбрасывается записью в БД.
+
+    dependencies(request, *args, **kwargs) — единственный список имён
+    поколений, от которых зависит страница, или None, если объекта нет
+    (тогда view вызывается без кэша). Поколения читаются до вызова view:
+    по ним сразу отвечается 304, а запись в БД во время рендера сменит
+    их, и собранная из прежних данных страница не попадёт под новые.
+    Страница отдаётся из кэша, пока ни одно поколение не изменилось.
+    Устаревшую страницу рендерит один запрос, остальные тем временем
+    получают прежнюю (singleflight).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            names = dependencies(request, *args, **kwargs)
+            if names is None:
+                return view(request, *args, **kwargs)
+            current = generations(names)
+            etag, modified = validators(request, current)
+            response = get_conditional_response(
+                request, etag=etag, last_modified=modified)
+            if response is not None:
+                return response
+
+            def render():
+                response = view(request, *args, **kwargs)
+                if (response.status_code != 200 or response.streaming
+                        or response.cookies):
+                    return None, response
+                return current, response
+
+            stored, response = singleflight.fetch(
+                page_key(request), render, settings.PAGE_CACHE_TIMEOUT,
+                fresh=lambda entry: entry[0] == current,
+                cacheable=lambda entry: entry[0] is not None)
+            if stored is not None and stored != current:
+                # Прежняя страница, пока новую рендерит другой запрос:
+                # валидаторы её поколений, иначе 304 закрепил бы её у
+                # клиента до следующей записи.
+                etag, modified = validators(request, stored)
+            return with_validators(response, etag, modified)
+        return wrapper
+    return decorator
@@ -0,0 +1,11 @@
+from django.utils.functional import SimpleLazyObject
+
+from . import following
+
+
+def followed_ids(request):
+    """followed_ids в шаблонах: `{% if author.pk in followed_ids %}`."""
+    return {
+        'followed_ids': SimpleLazyObject(
+            lambda: following.request_followed_ids(request)),
+    }
@@ -0,0 +1,66 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Comment, Follow, Post, User, UserCounters
+
+
+def get_counters(user):
+    """Счётчики пользователя; без записи в таблице — нулевые."""
+    try:
+        return user.counters
+    except UserCounters.DoesNotExist:
+        return UserCounters(user=user)
+
+
+def bump(user_id, field, delta):
+    """Атомарно меняет счётчик пользователя на delta."""
+    update = {field: F(field) + delta}
+    if UserCounters.objects.filter(pk=user_id).update(**update):
+        return
+    if delta > 0:
+        UserCounters.objects.get_or_create(pk=user_id)
+        UserCounters.objects.filter(pk=user_id).update(**update)
+
+
+def bump_comments(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comments_count=F('comments_count') + delta)
+
+
+def _count(queryset, field):
+    counts = (queryset.filter(**{field: OuterRef('pk')})
+              .order_by().values(field).annotate(count=Count('pk'))
+              .values('count'))
+    return Coalesce(Subquery(counts), 0)
+
+
+def _batches(queryset, batch_size):
+    last_pk = queryset.order_by('-pk').values_list('pk', flat=True).first()
+    for start in range(0, (last_pk or 0) + 1, batch_size):
+        yield queryset.filter(pk__gte=start, pk__lt=start + batch_size)
+
+
+def reconcile(batch_size=1000):
+    """Пересчитывает все счётчики пачками по диапазонам первичного ключа.
+
+    Возвращает число обработанных строк счётчиков пользователей и постов.
+    """
+    missing = User.objects.filter(counters__isnull=True).values_list(
+        'pk', flat=True)
+    # Размер пачки вставки выбирает Django: у SQLite есть предел на число
+    # строк в одном INSERT.
+    UserCounters.objects.bulk_create(
+        (UserCounters(pk=user_id) for user_id in missing.iterator()),
+        ignore_conflicts=True)
+    users = 0
+    for batch in _batches(UserCounters.objects.all(), batch_size):
+        users += batch.update(
+            posts=_count(Post.objects.all(), 'author'),
+            followers=_count(Follow.objects.all(), 'author'),
+            following=_count(Follow.objects.all(), 'user'),
+        )
+    posts = 0
+    for batch in _batches(Post.objects.all(), batch_size):
+        posts += batch.update(
+            comments_count=_count(Comment.objects.all(), 'post'))
+    return users, posts
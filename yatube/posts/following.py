@@ -0,0 +1,38 @@
+"""Множество авторов, на которых подписан пользователь.
+
+Хранится в кэше на пользователя и читается не больше раза за запрос,
+поэтому проверка «подписан ли» в шаблонах и view не стоит запросов.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from core import singleflight
+
+from . import caching
+from .models import Follow
+
+
+def cache_key(user_id):
+    # Эпоха сбрасывает подписки всех пользователей разом.
+    return f'following:{user_id}:{caching.epoch()}'
+
+
+def followed_ids(user_id):
+    return singleflight.fetch(
+        cache_key(user_id),
+        lambda: frozenset(Follow.objects.filter(user=user_id).values_list(
+            'author', flat=True)),
+        settings.FOLLOWING_CACHE_TIMEOUT)
+
+
+def request_followed_ids(request):
+    """Подписки текущего пользователя, один раз за запрос."""
+    if not request.user.is_authenticated:
+        return frozenset()
+    if not hasattr(request, '_followed_ids'):
+        request._followed_ids = followed_ids(request.user.pk)
+    return request._followed_ids
+
+
+def invalidate(user_id):
+    cache.delete(cache_key(user_id))
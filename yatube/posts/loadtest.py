@@ -0,0 +1,270 @@
+"""Нагрузочный прогон yatube.wsgi.application в многопоточном сервере.
+
+Виртуальные пользователи, анонимные и залогиненные, по HTTP читают
+ленты, подписываются, пишут посты и комментарии. Так видны блокировки
+SQLite на запись, которых не заметить в однопоточных замерах.
+"""
+import logging
+import random
+import sys
+import threading
+import time
+from http.cookiejar import Cookie, CookieJar
+from urllib import error, parse, request
+
+from django.conf import settings
+from django.core.servers.basehttp import (ThreadedWSGIServer,
+                                          WSGIRequestHandler)
+from django.core.signals import got_request_exception
+from django.db import OperationalError, connections
+from django.test import Client
+from django.urls import reverse
+
+from core import singleflight
+
+from .benchmarks import percentile
+from .models import Group, Post, User
+from .seeding import WORDS
+
+# Верхние границы корзин гистограммы задержек, мс.
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+ANONYMOUS_ACTIONS = (
+    ('index', 40), ('group_posts', 15), ('profile', 20),
+    ('post_detail', 20), ('search', 5),
+)
+USER_ACTIONS = ANONYMOUS_ACTIONS + (
+    ('follow_index', 25), ('follow', 4), ('unfollow', 3),
+    ('post_create', 3), ('add_comment', 6),
+)
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class Server:
+    """Многопоточный WSGI-сервер в фоновом потоке на свободном порту."""
+
+    def __init__(self, application):
+        self.httpd = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler)
+        self.httpd.set_app(application)
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       daemon=True)
+        self.lock_errors = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return f'http://{host}:{port}'
+
+    def count_lock_error(self, sender, **kwargs):
+        exception = sys.exc_info()[1]
+        if (isinstance(exception, OperationalError)
+                and 'locked' in str(exception)):
+            with self._lock:
+                self.lock_errors += 1
+
+    def __enter__(self):
+        got_request_exception.connect(self.count_lock_error)
+        # 404 на отписку от неподписанного автора — ожидаемая часть смеси,
+        # в лог идут только ошибки сервера.
+        self.logger = logging.getLogger('django.request')
+        self.level = self.logger.level
+        self.logger.setLevel(logging.ERROR)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.logger.setLevel(self.level)
+        got_request_exception.disconnect(self.count_lock_error)
+
+
+class NoRedirect(request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Targets:
+    """Имена, группы и посты из базы, по которым ходят пользователи."""
+
+    def __init__(self, sample=1000):
+        self.users = list(User.objects.order_by('-pk').values_list(
+            'pk', 'username')[:sample])
+        self.groups = list(Group.objects.values_list('slug', flat=True)[
+            :sample])
+        self.posts = list(Post.objects.order_by('-pk').values_list(
+            'pk', flat=True)[:sample])
+        if not self.users or not self.posts:
+            raise ValueError('База пуста: сначала запустите seed_data.')
+
+
+class VirtualUser:
+    def __init__(self, base_url, targets, rng, user=None):
+        self.base_url = base_url
+        self.targets = targets
+        self.rng = rng
+        self.cookies = CookieJar()
+        self.opener = request.build_opener(
+            request.HTTPCookieProcessor(self.cookies), NoRedirect)
+        self.actions, self.weights = zip(
+            *(USER_ACTIONS if user else ANONYMOUS_ACTIONS))
+        if user is not None:
+            self.login(user)
+
+    def login(self, user_id):
+        # Сессию создаёт force_login тестового клиента: пароли
+        # синтетических пользователей неизвестны.
+        client = Client()
+        client.force_login(User.objects.get(pk=user_id))
+        for name, morsel in client.cookies.items():
+            self.cookies.set_cookie(Cookie(
+                0, name, morsel.value, None, False, '127.0.0.1', False,
+                False, '/', True, False, None, False, None, None, {}))
+
+    def csrf_token(self):
+        for cookie in self.cookies:
+            if cookie.name == settings.CSRF_COOKIE_NAME:
+                return cookie.value
+        self.open(reverse('posts:post_create'))
+        return self.csrf_token()
+
+    def open(self, path, data=None):
+        headers = {}
+        if data is not None:
+            headers['X-CSRFToken'] = self.csrf_token()
+            data = parse.urlencode(data).encode()
+        req = request.Request(self.base_url + path, data, headers)
+        try:
+            with self.opener.open(req, timeout=30) as response:
+                response.read()
+                return response.status
+        except error.HTTPError as response:
+            return response.code
+
+    def path(self, action):
+        rng, targets = self.rng, self.targets
+        username = rng.choice(targets.users)[1]
+        post_id = rng.choice(targets.posts)
+        if action == 'group_posts' and targets.groups:
+            return reverse('posts:group_posts',
+                           kwargs={'slug': rng.choice(targets.groups)}), None
+        if action in ('profile', 'follow', 'unfollow'):
+            name = {'profile': 'profile', 'follow': 'profile_follow',
+                    'unfollow': 'profile_unfollow'}[action]
+            return reverse(f'posts:{name}',
+                           kwargs={'username': username}), None
+        if action == 'post_detail':
+            return reverse('posts:post_detail',
+                           kwargs={'post_id': post_id}), None
+        if action == 'search':
+            query = parse.urlencode({'q': rng.choice(WORDS)})
+            return f'{reverse("posts:search")}?{query}', None
+        if action == 'follow_index':
+            return reverse('posts:follow_index'), None
+        if action == 'post_create':
+            return reverse('posts:post_create'), {'text': 'Нагрузка'}
+        if action == 'add_comment':
+            return reverse('posts:add_comment',
+                           kwargs={'post_id': post_id}), {'text': 'Ок'}
+        return reverse('posts:index'), None
+
+    def step(self):
+        """Одно действие: (имя, статус или None при сбое, задержка в мс)."""
+        action = self.rng.choices(self.actions, weights=self.weights)[0]
+        path, data = self.path(action)
+        started = time.perf_counter()
+        try:
+            status = self.open(path, data)
+        except (OSError, error.URLError):
+            status = None
+        return action, status, (time.perf_counter() - started) * 1000
+
+
+def histogram(timings):
+    counts = dict.fromkeys([*(f'<={bucket}' for bucket in BUCKETS),
+                            f'>{BUCKETS[-1]}'], 0)
+    for timing in timings:
+        for bucket in BUCKETS:
+            if timing <= bucket:
+                counts[f'<={bucket}'] += 1
+                break
+        else:
+            counts[f'>{BUCKETS[-1]}'] += 1
+    return counts
+
+
+def run_level(server, targets, concurrency, duration, logged_in, seed):
+    """Прогон с concurrency пользователями в течение duration секунд."""
+    records = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(number):
+        rng = random.Random(seed * 100003 + number)
+        user = (rng.choice(targets.users)[0] if rng.random() < logged_in
+                else None)
+        virtual = VirtualUser(server.url, targets, rng, user)
+        local = []
+        while time.monotonic() < deadline:
+            local.append(virtual.step())
+        with lock:
+            records.extend(local)
+        connections.close_all()
+
+    lock_errors = server.lock_errors
+    coalesced = singleflight.stats()
+    threads = [threading.Thread(target=worker, args=(number,))
+               for number in range(concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    summary = summarize(records, elapsed, concurrency,
+                        server.lock_errors - lock_errors)
+    # Сервер работает в этом же процессе, так что счётчики пересчётов
+    # кэша относятся к прогону.
+    summary['singleflight'] = {
+        name: value - coalesced[name]
+        for name, value in singleflight.stats().items()}
+    return summary
+
+
+def summarize(records, elapsed, concurrency, lock_errors):
+    timings = [timing for _, _, timing in records] or [0]
+    failed = sum(1 for _, status, _ in records
+                 if status is None or status >= 500)
+    rejected = sum(1 for _, status, _ in records
+                   if status is not None and 400 <= status < 500)
+    total = len(records) or 1
+    actions = {}
+    for action, status, timing in records:
+        actions.setdefault(action, []).append(timing)
+    return {
+        'concurrency': concurrency,
+        'requests': len(records),
+        'throughput_rps': round(len(records) / elapsed, 1),
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+        'p99_ms': round(percentile(timings, 99), 2),
+        'error_rate': round(failed / total, 4),
+        'client_error_rate': round(rejected / total, 4),
+        'lock_timeout_rate': round(lock_errors / total, 4),
+        'histogram': histogram(timings),
+        'actions': {action: {'requests': len(values),
+                             'p95_ms': round(percentile(values, 95), 2)}
+                    for action, values in sorted(actions.items())},
+    }
+
+
+def run(application, levels, duration, logged_in=0.3, seed=0):
+    targets = Targets()
+    with Server(application) as server:
+        return [run_level(server, targets, concurrency, duration, logged_in,
+                          seed)
+                for concurrency in levels]
@@ -0,0 +1,82 @@
+import json
+from contextlib import ExitStack
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import singleflight
+from posts import benchmarks, seeding, transfer
+
+
+class Command(BaseCommand):
+    help = ('Замеряет время, запросы к БД, размер и память страниц posts '
+            'и сравнивает с сохранёнными результатами.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument(
+            '--warm', action='store_true',
+            help='Не сбрасывать кэш между запросами.')
+        parser.add_argument('--view', action='append', dest='views',
+                            help='Замерить только эту страницу.')
+        parser.add_argument('--output', help='Куда сохранить JSON.')
+        parser.add_argument('--baseline',
+                            help='JSON прошлого запуска для сравнения.')
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help='Допустимое замедление p50/p95 в долях (0.2 = 20%%).')
+        parser.add_argument(
+            '--fresh', action='store_true',
+            help='Замерять на временной тестовой базе, заполненной '
+                 'seed_data.')
+        parser.add_argument('--posts', type=int, default=10000,
+                            help='Размер временной базы для --fresh.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as stream:
+                baseline = json.load(stream)
+        with ExitStack() as stack:
+            if options['fresh']:
+                progress = transfer.Progress(self.stderr.write,
+                                             options['posts'] * 10)
+                stack.enter_context(seeding.temporary_database(
+                    options['posts'], progress, options['seed']))
+            try:
+                results = benchmarks.run(
+                    options['iterations'], options['warmup'],
+                    options['warm'], options['views'])
+            except ValueError as error:
+                raise CommandError(error)
+        self.report(results)
+        data = json.dumps(results, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as stream:
+                stream.write(data + '\n')
+        else:
+            self.stdout.write(data)
+        if baseline is not None:
+            found = benchmarks.regressions(results, baseline,
+                                           options['threshold'])
+            if found:
+                raise CommandError('Регрессии:\n' + '\n'.join(found))
+            self.stdout.write(self.style.SUCCESS('Регрессий нет.'))
+
+    def report(self, results):
+        self.stderr.write(
+            f'{"страница":<14}{"p50":>9}{"p95":>9}{"p99":>9}'
+            f'{"запросы":>9}{"байты":>9}{"пик КБ":>9}')
+        for name, result in results.items():
+            self.stderr.write(
+                f'{name:<14}{result["p50_ms"]:>9}{result["p95_ms"]:>9}'
+                f'{result["p99_ms"]:>9}{result["queries"]:>9}'
+                f'{result["bytes"]:>9}{result["peak_kb"]:>9}')
+        for name, result in results.items():
+            for tier, stats in result.get('cache', {}).items():
+                self.stderr.write(
+                    f'{name} кэш {tier}: попаданий {stats["hits"]}, '
+                    f'промахов {stats["misses"]}')
+        self.stderr.write('singleflight: ' + ', '.join(
+            f'{name} {value}' for name, value in singleflight.stats().items()))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import query_plans
+
+
+class Command(BaseCommand):
+    help = ('Прогоняет запросы страниц posts через EXPLAIN и отмечает '
+            'полные проходы по таблицам и временные сортировки.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--view', action='append', dest='views',
+                            help='Проверить только эту страницу.')
+        parser.add_argument(
+            '--ignore-table', action='append', dest='ignore_tables',
+            default=list(query_plans.SMALL_TABLES),
+            help='Не считать проблемой проход по этой (маленькой) таблице.')
+        parser.add_argument('--plans', action='store_true',
+                            help='Печатать планы всех запросов.')
+        parser.add_argument('--fail', action='store_true',
+                            help='Завершаться ошибкой, если есть проблемы.')
+
+    def handle(self, *args, **options):
+        try:
+            report = query_plans.advise(options['views'],
+                                        options['ignore_tables'])
+        except ValueError as error:
+            raise CommandError(error)
+        flagged = 0
+        for name, entries in report.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'{name}: запросов {len(entries)}'))
+            for sql, plan, found in entries:
+                if not found and not options['plans']:
+                    continue
+                self.stdout.write(f'  {sql}')
+                for line in plan:
+                    self.stdout.write(f'    {line}')
+                for reason, line in found:
+                    flagged += 1
+                    self.stdout.write(self.style.WARNING(
+                        f'    ! {reason}: {line}'))
+        if flagged and options['fail']:
+            raise CommandError(f'Проблемных планов: {flagged}.')
+        self.stdout.write(self.style.SUCCESS(
+            f'Проблемных планов: {flagged}.'))
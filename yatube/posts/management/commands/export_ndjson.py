@@ -0,0 +1,29 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from posts import transfer
+
+
+class Command(BaseCommand):
+    help = 'Выгружает группы, посты, комментарии и подписки в NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-',
+                            help='Файл для выгрузки, «-» — stdout.')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--progress-every', type=int, default=100000)
+
+    def handle(self, *args, **options):
+        # При выгрузке в stdout прогресс идёт в stderr, чтобы не смешиваться
+        # с данными.
+        to_stdout = options['path'] == '-'
+        report = self.stderr if to_stdout else self.stdout
+        progress = transfer.Progress(report.write, options['progress_every'])
+        if to_stdout:
+            transfer.export(sys.stdout, progress, options['chunk_size'])
+        else:
+            with open(options['path'], 'w', encoding='utf-8') as stream:
+                transfer.export(stream, progress, options['chunk_size'])
+        for model in progress.counts:
+            progress.report(model)
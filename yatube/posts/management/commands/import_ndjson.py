@@ -0,0 +1,38 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from posts import transfer
+
+
+class Command(BaseCommand):
+    help = ('Загружает NDJSON из export_ndjson пачками bulk_create и '
+            'пересчитывает счётчики, поисковый индекс и ленты.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-',
+                            help='Файл с данными, «-» — stdin.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--progress-every', type=int, default=100000)
+        parser.add_argument(
+            '--skip-derived', action='store_true',
+            help='Не пересчитывать счётчики, индекс и ленты после загрузки.')
+
+    def handle(self, *args, **options):
+        progress = transfer.Progress(self.stdout.write,
+                                     options['progress_every'])
+        if options['path'] == '-':
+            importer = transfer.import_rows(sys.stdin, progress,
+                                            options['batch_size'])
+        else:
+            with open(options['path'], encoding='utf-8') as stream:
+                importer = transfer.import_rows(stream, progress,
+                                                options['batch_size'])
+        for model in progress.counts:
+            progress.report(model)
+        if importer.created_users:
+            self.stdout.write(
+                f'Создано пользователей: {importer.created_users}.')
+        if not options['skip_derived']:
+            transfer.rebuild_derived(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Импорт завершён.'))
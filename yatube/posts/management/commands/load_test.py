@@ -0,0 +1,65 @@
+import json
+from contextlib import ExitStack
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import loadtest, seeding, transfer
+from yatube.wsgi import application
+
+
+def levels(value):
+    return [int(level) for level in value.split(',')]
+
+
+class Command(BaseCommand):
+    help = ('Нагружает yatube.wsgi.application в многопоточном сервере '
+            'смесью анонимных и залогиненных пользователей.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=levels, default=[1, 4, 16],
+            help='Уровни числа пользователей через запятую.')
+        parser.add_argument('--duration', type=float, default=10,
+                            help='Секунд на каждый уровень.')
+        parser.add_argument('--logged-in', type=float, default=0.3,
+                            help='Доля залогиненных пользователей.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Куда сохранить JSON.')
+        parser.add_argument(
+            '--use-current-db', action='store_true',
+            help='Нагружать рабочую базу. Пользователи пишут посты, '
+                 'комментарии и подписки, поэтому по умолчанию прогон '
+                 'идёт на временной базе, заполненной seed_data.')
+        parser.add_argument('--posts', type=int, default=10000,
+                            help='Размер временной базы.')
+
+    def handle(self, *args, **options):
+        with ExitStack() as stack:
+            if not options['use_current_db']:
+                progress = transfer.Progress(self.stderr.write,
+                                             options['posts'] * 10)
+                stack.enter_context(seeding.temporary_database(
+                    options['posts'], progress, options['seed']))
+            try:
+                results = loadtest.run(
+                    application, options['concurrency'],
+                    options['duration'], options['logged_in'],
+                    options['seed'])
+            except ValueError as error:
+                raise CommandError(error)
+        self.stderr.write(
+            f'{"потоки":>7}{"запросы":>9}{"RPS":>9}{"p50":>9}{"p95":>9}'
+            f'{"p99":>9}{"ошибки":>9}{"locked":>9}')
+        for level in results:
+            self.stderr.write(
+                f'{level["concurrency"]:>7}{level["requests"]:>9}'
+                f'{level["throughput_rps"]:>9}{level["p50_ms"]:>9}'
+                f'{level["p95_ms"]:>9}{level["p99_ms"]:>9}'
+                f'{level["error_rate"]:>9.2%}'
+                f'{level["lock_timeout_rate"]:>9.2%}')
+        data = json.dumps(results, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as stream:
+                stream.write(data + '\n')
+        else:
+            self.stdout.write(data)
@@ -0,0 +1,63 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.db import connections
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+from posts.models import Post
+
+
+def generate(name):
+    try:
+        thumbnails.generate(name)
+    except Exception as error:
+        return name, str(error)
+    finally:
+        connections.close_all()
+    return name, None
+
+
+class Command(BaseCommand):
+    help = 'Создаёт миниатюры для всех картинок постов в пуле процессов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=None)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        names = (Post.objects.exclude(image='').order_by('pk')
+                 .values_list('image', flat=True))
+        batch = []
+        done = failed = 0
+        started = time.monotonic()
+        # spawn, а не fork: дочерние процессы открывают свои соединения с БД.
+        pool = ProcessPoolExecutor(
+            options['processes'],
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup)
+        with pool:
+            for name in names.iterator():
+                batch.append(name)
+                if len(batch) < options['batch_size']:
+                    continue
+                done, failed = self.run_batch(pool, batch, done, failed,
+                                              started)
+                batch = []
+            if batch:
+                done, failed = self.run_batch(pool, batch, done, failed,
+                                              started)
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: {done} картинок, ошибок {failed}.'))
+
+    def run_batch(self, pool, batch, done, failed, started):
+        for name, error in pool.map(generate, batch, chunksize=10):
+            done += 1
+            if error:
+                failed += 1
+                self.stderr.write(f'{name}: {error}')
+        rate = done / max(time.monotonic() - started, 1e-6)
+        self.stdout.write(f'{done} картинок, {rate:.1f} в секунду')
+        return done, failed
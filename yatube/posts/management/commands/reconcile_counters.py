@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from posts import counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики постов, комментариев и подписок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        users, posts = counters.reconcile(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано: пользователей {users}, постов {posts}.'))
@@ -0,0 +1,50 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import seeding, transfer
+from posts.models import User
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими пользователями, группами, '
+            'постами, комментариями и подписками.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=10000)
+        parser.add_argument('--comments', type=int, default=20000)
+        parser.add_argument('--follows', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--prefix', default='user',
+                            help='Префикс имён пользователей и slug групп.')
+        parser.add_argument('--days', type=int, default=365,
+                            help='За сколько дней разбросаны даты постов.')
+        parser.add_argument('--end-date', type=date.fromisoformat,
+                            help='Последний день дат (YYYY-MM-DD), '
+                                 'по умолчанию сегодня.')
+        parser.add_argument('--progress-every', type=int, default=100000)
+        parser.add_argument(
+            '--skip-derived', action='store_true',
+            help='Не пересчитывать счётчики, индекс и ленты после загрузки.')
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if User.objects.filter(username=f'{prefix}0').exists():
+            raise CommandError(
+                f'Пользователи с префиксом «{prefix}» уже есть, '
+                f'укажите другой --prefix.')
+        progress = transfer.Progress(self.stdout.write,
+                                     options['progress_every'])
+        seeding.generate(
+            options['users'], options['groups'], options['posts'],
+            options['comments'], options['follows'], progress,
+            seed=options['seed'], batch_size=options['batch_size'],
+            prefix=prefix, days=options['days'], end=options['end_date'])
+        for model in progress.counts:
+            progress.report(model)
+        if not options['skip_derived']:
+            transfer.rebuild_derived(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('База заполнена.'))
@@ -0,0 +1,47 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core import slow_queries
+
+
+class Command(BaseCommand):
+    help = ('Сводка журнала медленных запросов: какие запросы, view и '
+            'шаблоны отняли больше всего времени.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--log', default=settings.SLOW_QUERY_LOG,
+            help='Журнал; ротированные копии .1, .2, ... читаются тоже.')
+        parser.add_argument('--top', type=int, default=20)
+        parser.add_argument(
+            '--by', choices=('fingerprint', 'view', 'template'),
+            default='fingerprint', help='Как группировать записи.')
+        parser.add_argument('--json', action='store_true',
+                            help='Вывести сводку в JSON.')
+
+    def handle(self, *args, **options):
+        files = slow_queries.log_files(options['log'])
+        if not files:
+            raise CommandError(f'Журнал {options["log"]} не найден.')
+        groups = slow_queries.summarize(slow_queries.read(files),
+                                        options['by'], options['top'])
+        if options['json']:
+            self.stdout.write(json.dumps(groups, indent=2,
+                                         ensure_ascii=False))
+            return
+        if not groups:
+            self.stdout.write(self.style.SUCCESS('Медленных запросов нет.'))
+            return
+        for group in groups:
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'{group[options["by"]]}: {group["count"]} раз, всего '
+                f'{group["total_ms"]} мс, в среднем {group["mean_ms"]} мс, '
+                f'максимум {group["max_ms"]} мс'))
+            self.stdout.write(f'  {group["sql"]}')
+            for title, counts in (('view', group['views']),
+                                  ('шаблон', group['templates'])):
+                for name, count in sorted(counts.items(),
+                                          key=lambda item: -item[1]):
+                    self.stdout.write(f'  {title}: {name} ({count})')
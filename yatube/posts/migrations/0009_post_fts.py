@@ -0,0 +1,35 @@
+from django.db import migrations
+
+FTS_TABLE = 'posts_post_fts'
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f'CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5('
+        f"text, group_title, author_name, tokenize = 'unicode61')")
+    schema_editor.execute(
+        f'INSERT INTO {FTS_TABLE} (rowid, text, group_title, author_name) '
+        f"SELECT post.id, post.text, COALESCE(grp.title, ''), "
+        f"author.username || ' ' || author.first_name "
+        f"|| ' ' || author.last_name "
+        f'FROM posts_post AS post '
+        f'JOIN auth_user AS author ON author.id = post.author_id '
+        f'LEFT JOIN posts_group AS grp ON grp.id = post.group_id')
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0008_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
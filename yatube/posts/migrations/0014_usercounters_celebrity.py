@@ -0,0 +1,26 @@
+# Generated by Django 2.2.16 on 2026-10-18 18:59
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_celebrity(apps, schema_editor):
+    UserCounters = apps.get_model('posts', 'UserCounters')
+    UserCounters.objects.filter(
+        followers__gte=settings.TIMELINE_FANOUT_LIMIT).update(celebrity=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_timelineentry_pub_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usercounters',
+            name='celebrity',
+            field=models.BooleanField(db_index=True, default=False, verbose_name='знаменитость'),
+        ),
+        migrations.RunPython(fill_celebrity, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,21 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 
 length: int = 15
 
 
+class AtomicSave:
+    """save() в одной транзакции с обработчиками post_save.
+
+    Сигналы меняют счётчики и ленты: вместе с записью или никак. Удаление
+    Django и так ведёт в транзакции вместе с post_delete.
+    """
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using'), savepoint=False):
+            super().save(*args, **kwargs)
+
+
 class Group(models.Model):
     title = models.CharField(max_length=200)
     slug = models.SlugField(max_length=255, unique=True, db_index=True,
@@ -14,18 +26,22 @@ class Group(models.Model):
         return self.title
 
 
-class Post(models.Model):
+class Post(AtomicSave, models.Model):
     text = models.TextField(
         verbose_name='Текст поста',
         help_text='Введите текст поста')
     pub_date = models.DateTimeField('дата публикации', auto_now_add=True)
+    modified = models.DateTimeField('дата изменения', auto_now=True)
+    # Одиночные индексы по author и group не нужны: их заменяют
+    # составные индексы лент из Meta.
     author = models.ForeignKey(User, on_delete=models.CASCADE,
                                related_name='posts_author',
-                               verbose_name='Автор'
+                               verbose_name='Автор',
+                               db_index=False
                                )
     group = models.ForeignKey(Group, on_delete=models.SET_NULL,
                               related_name='posts_group',
-                              blank=True, null=True,
+                              blank=True, null=True, db_index=False,
                               verbose_name='Группа',
                               help_text='Выберите группу'
                               )
@@ -33,41 +49,114 @@ class Post(models.Model):
                               upload_to='posts/',
                               blank=True
                               )
+    comments_count = models.IntegerField('комментариев', default=0,
+                                         editable=False)
+    image_variants = models.TextField('варианты изображения', blank=True,
+                                      editable=False)
 
     class Meta:
         ordering = ['-pub_date']
+        # Ленты сортируются по (-pub_date, -pk): индекс с теми же полями
+        # отдаёт страницу без сортировки во временном B-дереве.
+        indexes = (
+            models.Index(fields=['-pub_date', '-id'],
+                         name='post_pub_date_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='post_author_pub_date_idx'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='post_group_pub_date_idx'),
+        )
 
     def __str__(self):
         return self.text[:length]
 
 
-class Comment(models.Model):
+class Comment(AtomicSave, models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE,
                              related_name="comments",
-                             verbose_name='Пост')
+                             verbose_name='Пост', db_index=False)
     author = models.ForeignKey(User, on_delete=models.CASCADE,
                                related_name="comments",
                                verbose_name='Автор')
     text = models.TextField(verbose_name='Комментарий')
     created = models.DateTimeField('дата публикации', auto_now_add=True,)
 
+    class Meta:
+        indexes = (
+            models.Index(fields=['post', 'created', 'id'],
+                         name='comment_post_created_idx'),
+        )
+
     def __str__(self):
         return self.text[:length]
 
 
-class Follow(models.Model):
+class Follow(AtomicSave, models.Model):
+    # Поиск по user покрывает unique_follow, по author — follow_author_idx.
     user = models.ForeignKey(User, on_delete=models.CASCADE,
                              related_name='follower',
-                             verbose_name='подписчики'
+                             verbose_name='подписчики',
+                             db_index=False
                              )
     author = models.ForeignKey(User, on_delete=models.CASCADE,
                                related_name='following',
-                               verbose_name='автор'
+                               verbose_name='автор',
+                               db_index=False
                                )
 
     class Meta:
         constraints = (models.UniqueConstraint(fields=['user', 'author'],
-                                               name='unique_follow'))
+                                               name='unique_follow'),)
+        indexes = (
+            models.Index(fields=['author', 'user'],
+                         name='follow_author_idx'),
+        )
+
+    def __str__(self):
+        return self.user.username
+
+
+class TimelineEntry(models.Model):
+    """Пост в материализованной ленте подписчика (fan-out on write)."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name='timeline',
+                             verbose_name='читатель',
+                             db_index=False
+                             )
+    post = models.ForeignKey(Post, on_delete=models.CASCADE,
+                             related_name='timeline_entries',
+                             verbose_name='пост'
+                             )
+    # Копия post.pub_date: страница ленты читается по индексу записей,
+    # без соединения с постами и сортировки.
+    pub_date = models.DateTimeField('дата публикации')
+
+    class Meta:
+        constraints = (models.UniqueConstraint(fields=['user', 'post'],
+                                               name='unique_timeline_entry'),)
+        indexes = (
+            models.Index(fields=['user', '-pub_date', '-post'],
+                         name='timeline_user_pub_date_idx'),
+        )
+
+    def __str__(self):
+        return f'{self.user_id}: {self.post_id}'
+
+
+class UserCounters(models.Model):
+    """Счётчики пользователя, которые поддерживаются сигналами."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name='counters',
+                                verbose_name='пользователь'
+                                )
+    posts = models.IntegerField('постов', default=0)
+    followers = models.IntegerField('подписчиков', default=0)
+    following = models.IntegerField('подписок', default=0)
+    # Посты «знаменитости» не рассылаются по лентам, а читаются при
+    # запросе. Флаг меняется при подписке и отписке (posts.timelines).
+    celebrity = models.BooleanField('знаменитость', default=False,
+                                    db_index=True)
 
     def __str__(self):
         return self.user.username
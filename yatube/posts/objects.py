@@ -0,0 +1,128 @@
+"""Кэш объектов Post, Group и User по pk и естественному ключу.
+
+Объект читается из кэша, а при промахе — из БД одним запросом на
+все параллельные (singleflight). Естественный ключ (slug группы,
+username) указывает на pk, поэтому объект хранится в одном месте.
+
+Ключ объекта содержит его поколение (как у страниц в caching), и
+сигналы сохранения и удаления не удаляют запись, а меняют поколение.
+Так запись, прочитанная из БД до правки и положенная в кэш после неё,
+остаётся под прежним ключом и больше не читается.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404
+
+from core import singleflight
+
+from . import caching
+from .models import Group, User
+
+NATURAL_KEYS = {Group: 'slug', User: 'username'}
+
+
+def queryset(model):
+    if model is User:
+        # Хэш пароля в общем кэше не нужен ни одной странице.
+        return User.objects.defer('password')
+    return model._default_manager.all()
+
+
+def generation(model, pk):
+    return f'object:{model._meta.label_lower}:{pk}'
+
+
+def cache_key(model, pk, token):
+    return f'objects:{model._meta.label_lower}:{pk}:{token}'
+
+
+def tokens(model, pks):
+    """{pk: токен ключа}: поколение объекта вместе с общей эпохой."""
+    names = {pk: generation(model, pk) for pk in pks}
+    current = caching.generations(names.values())
+    return {pk: f'{current[caching.EPOCH]}|{current[name]}'
+            for pk, name in names.items()}
+
+
+def natural_cache_key(model, value):
+    # Значение хэшируется: slug и username бывают не-ASCII, а такие
+    # ключи не принимает memcached.
+    field = NATURAL_KEYS[model]
+    digest = hashlib.md5(str(value).encode()).hexdigest()
+    return f'objects:{model._meta.label_lower}:{field}:{digest}'
+
+
+def _by_pk(model, pk):
+    return singleflight.fetch(
+        cache_key(model, pk, tokens(model, [pk])[pk]),
+        lambda: queryset(model).filter(pk=pk).first(),
+        settings.OBJECT_CACHE_TIMEOUT,
+        cacheable=lambda obj: obj is not None)
+
+
+def _by_natural_key(model, value):
+    field = NATURAL_KEYS[model]
+    key = natural_cache_key(model, value)
+    pk = singleflight.fetch(
+        key,
+        lambda: queryset(model).filter(**{field: value}).values_list(
+            'pk', flat=True).first(),
+        settings.OBJECT_CACHE_TIMEOUT,
+        cacheable=lambda pk: pk is not None)
+    if pk is None:
+        return None
+    obj = _by_pk(model, pk)
+    if obj is None or getattr(obj, field) != value:
+        # Ключ переименованного объекта: запись устарела.
+        cache.delete(key)
+        return queryset(model).filter(**{field: value}).first()
+    return obj
+
+
+def get(model, pk=None, **natural):
+    """Объект по pk или естественному ключу (`slug=`, `username=`).
+
+    Возвращает None, если объекта нет; отсутствие не кэшируется.
+    """
+    if natural:
+        (field, value), = natural.items()
+        if NATURAL_KEYS.get(model) != field:
+            raise TypeError(f'{model.__name__} не ищется по {field}')
+        return _by_natural_key(model, value)
+    return _by_pk(model, pk)
+
+
+def get_or_404(model, pk=None, **natural):
+    obj = get(model, pk, **natural)
+    if obj is None:
+        raise Http404(f'{model._meta.verbose_name} не найден')
+    return obj
+
+
+def get_many(model, pks):
+    """{pk: объект} для найденных pk; промахи читаются одним запросом."""
+    keys = {cache_key(model, pk, token): pk
+            for pk, token in tokens(model, pks).items()}
+
+    def load(missing):
+        found = queryset(model).in_bulk([keys[key] for key in missing])
+        return {key: found[keys[key]] for key in missing
+                if keys[key] in found}
+
+    found = singleflight.fetch_many(list(keys), load,
+                                    settings.OBJECT_CACHE_TIMEOUT)
+    return {keys[key]: obj for key, obj in found.items() if key in keys}
+
+
+def forget(model, pk):
+    caching.bump(generation(model, pk))
+
+
+def invalidate(instance):
+    model = type(instance)
+    forget(model, instance.pk)
+    if model in NATURAL_KEYS:
+        cache.delete(natural_cache_key(
+            model, getattr(instance, NATURAL_KEYS[model])))
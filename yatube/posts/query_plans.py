@@ -0,0 +1,86 @@
+"""Проверка планов запросов, которые выполняют страницы posts.
+
+Запросы каждой страницы перехватываются при настоящем запросе тестового
+клиента и прогоняются через EXPLAIN. Полный проход по таблице и
+сортировка во временной структуре считаются проблемами.
+"""
+import re
+
+from django.db import connection
+from django.test import Client
+
+from core import caches
+
+from .benchmarks import scenarios, subjects
+
+# Маленькие справочники, которые читаются целиком намеренно.
+SMALL_TABLES = ('posts_group',)
+SQLITE_PROBLEMS = (
+    # «SCAN t» без индекса — полный проход; «SCAN t USING INDEX» и поиск
+    # по FTS-индексу («VIRTUAL TABLE INDEX») — нет.
+    (re.compile(r'^SCAN (?!.*\b(USING|VIRTUAL TABLE)\b)(?!CONSTANT ROW)'),
+     'полный проход'),
+    (re.compile(r'USE TEMP B-TREE'), 'временная сортировка'),
+)
+POSTGRES_PROBLEMS = (
+    (re.compile(r'Seq Scan'), 'полный проход'),
+    (re.compile(r'^\s*(->\s*)?Sort\b'), 'временная сортировка'),
+)
+
+
+def capture(client, url):
+    """SELECT-запросы страницы с параметрами, без повторов.
+
+    Страница строится с пустым кэшем, своим на время вызова: общий кэш
+    сайта не читается и не чистится.
+    """
+    queries = {}
+
+    def wrapper(execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith('SELECT'):
+            queries.setdefault(sql, params)
+        return execute(sql, params, many, context)
+    with caches.isolated(), connection.execute_wrapper(wrapper):
+        client.get(url)
+    return list(queries.items())
+
+
+def explain(sql, params):
+    if connection.vendor == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    else:
+        prefix = 'EXPLAIN '
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql, params)
+        rows = cursor.fetchall()
+    # SQLite отдаёт (id, parent, notused, detail), PostgreSQL — строку.
+    return [row[-1] for row in rows]
+
+
+def problems(plan):
+    patterns = (SQLITE_PROBLEMS if connection.vendor == 'sqlite'
+                else POSTGRES_PROBLEMS)
+    if any('VIRTUAL TABLE' in line for line in plan):
+        # Ранг bm25 считается при запросе, сортировки по нему не избежать.
+        patterns = patterns[:1]
+    return [(reason, line) for line in plan
+            for pattern, reason in patterns if pattern.search(line)]
+
+
+def advise(only=None, ignore_tables=SMALL_TABLES):
+    """Для каждой страницы: список (запрос, план, проблемы)."""
+    report = {}
+    for name, url, user in scenarios(subjects()):
+        if only and name not in only:
+            continue
+        client = Client()
+        if user is not None:
+            client.force_login(user)
+        entries = []
+        for sql, params in capture(client, url):
+            plan = explain(sql, params)
+            found = [(reason, line) for reason, line in problems(plan)
+                     if not any(table in line for table in ignore_tables)]
+            entries.append((sql, plan, found))
+        report[name] = entries
+    return report
@@ -0,0 +1,125 @@
+import re
+
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+
+from .models import Group, Post, User
+
+FTS_TABLE = 'posts_post_fts'
+WORD = re.compile(r'\w+')
+
+# Строки индекса собираются одним запросом прямо из таблиц постов,
+# пользователей и групп, без загрузки моделей в Python.
+INDEX_ROWS = f'''
+    INSERT INTO {FTS_TABLE} (rowid, text, group_title, author_name)
+    SELECT post.id, post.text, COALESCE(grp.title, ''),
+           author.username || ' ' || author.first_name
+           || ' ' || author.last_name
+    FROM {Post._meta.db_table} AS post
+    JOIN {User._meta.db_table} AS author ON author.id = post.author_id
+    LEFT JOIN {Group._meta.db_table} AS grp ON grp.id = post.group_id
+'''
+
+
+def available():
+    return connection.vendor == 'sqlite'
+
+
+def match_expression(query):
+    """Запрос пользователя в синтаксисе FTS5: все слова по префиксу."""
+    words = WORD.findall(query)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def index_posts(where, params):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid IN '
+            f'(SELECT post.id FROM {Post._meta.db_table} AS post '
+            f'WHERE {where})', params)
+        cursor.execute(f'{INDEX_ROWS} WHERE {where}', params)
+
+
+def index_post(post_id):
+    if available():
+        index_posts('post.id = %s', [post_id])
+
+
+def remove_post(post_id):
+    if available():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                           [post_id])
+
+
+def index_group(group_id):
+    if available():
+        index_posts('post.group_id = %s', [group_id])
+
+
+def clear_group(group_id):
+    if available():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {FTS_TABLE} SET group_title = '' WHERE rowid IN "
+                f'(SELECT id FROM {Post._meta.db_table} WHERE group_id = %s)',
+                [group_id])
+
+
+def index_author(author_id):
+    if available():
+        index_posts('post.author_id = %s', [author_id])
+
+
+def rebuild(batch_size=10000):
+    """Перестраивает индекс пачками по диапазонам id, по транзакции на пачку.
+
+    Возвращает число проиндексированных постов.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+    last_pk = Post.objects.order_by('-pk').values_list(
+        'pk', flat=True).first() or 0
+    indexed = 0
+    for start in range(0, last_pk + 1, batch_size):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f'{INDEX_ROWS} WHERE post.id >= %s AND post.id < %s',
+                [start, start + batch_size])
+            indexed += cursor.rowcount
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    return indexed
+
+
+def filter_posts(queryset, query):
+    """Посты из queryset, подходящие под запрос (без ранжирования)."""
+    if not available():
+        return queryset.filter(text__icontains=query)
+    match = match_expression(query)
+    if not match:
+        return queryset.none()
+    return queryset.filter(pk__in=RawSQL(
+        f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+        (match,)))
+
+
+def find_posts(query, offset, limit):
+    """Страница постов по релевантности и флаг наличия следующей."""
+    queryset = Post.objects.select_related('author', 'group')
+    if not available():
+        posts = list(filter_posts(queryset, query)[offset:offset + limit + 1])
+        return posts[:limit], len(posts) > limit
+    match = match_expression(query)
+    if not match:
+        return [], False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+            f'ORDER BY bm25({FTS_TABLE}, 1.0, 0.5, 0.5) LIMIT %s OFFSET %s',
+            [match, limit + 1, offset])
+        ids = [row[0] for row in cursor.fetchall()]
+    found = queryset.in_bulk(ids[:limit])
+    posts = [found[pk] for pk in ids[:limit] if pk in found]
+    return posts, len(ids) > limit
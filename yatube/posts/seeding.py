@@ -0,0 +1,237 @@
+"""Генератор синтетической базы для нагрузочных замеров.
+
+Распределения неравномерные, как в живой соцсети: число подписчиков и
+постов у авторов подчиняется степенному закону, посты идут всплесками
+по дням. Все случайные величины берутся из одного random.Random(seed),
+поэтому запуск с тем же seed на пустой базе даёт те же данные.
+"""
+import os
+import random
+import tempfile
+from array import array
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core import caches
+
+from .models import Comment, Follow, Group, Post, User
+from .transfer import keep_dates, rebuild_derived
+
+WORDS = (
+    'лес', 'река', 'город', 'утро', 'вечер', 'книга', 'дорога', 'море',
+    'ветер', 'снег', 'письмо', 'друг', 'дом', 'окно', 'песня', 'небо',
+    'поезд', 'чай', 'сад', 'мост', 'свет', 'тень', 'голос', 'память',
+    'новый', 'старый', 'тихий', 'быстрый', 'светлый', 'долгий',
+    'читать', 'писать', 'думать', 'ждать', 'помнить', 'видеть',
+)
+
+
+def power_law_weights(count, exponent):
+    """Накопленные веса Ципфа: элемент ранга k весит 1 / k ** exponent."""
+    return list(accumulate(1 / rank ** exponent
+                           for rank in range(1, count + 1)))
+
+
+class Seeder:
+    def __init__(self, seed, batch_size, progress, prefix='user',
+                 days=365, end=None, exponent=1.1):
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.progress = progress
+        self.prefix = prefix
+        self.days = days
+        self.end = end or timezone.localdate()
+        self.exponent = exponent
+
+    def text(self, low, high):
+        words = self.rng.choices(WORDS, k=self.rng.randint(low, high))
+        return ' '.join(words).capitalize()
+
+    def ranked(self, ids):
+        """Перемешанные id и веса: несколько «гиперактивных» в случайных
+        местах, а не первые по порядку."""
+        ids = list(ids)
+        self.rng.shuffle(ids)
+        return ids, power_law_weights(len(ids), self.exponent)
+
+    def dates(self):
+        """Функция, выдающая время поста: дни с весами Парето дают
+        всплески активности на фоне тихих дней."""
+        start = timezone.make_aware(datetime.combine(
+            self.end - timedelta(days=self.days), time()))
+        days = list(range(self.days))
+        weights = list(accumulate(self.rng.paretovariate(1.2) for _ in days))
+
+        def pick():
+            day = self.rng.choices(days, cum_weights=weights)[0]
+            return start + timedelta(days=day,
+                                     seconds=self.rng.uniform(0, 86400))
+        return pick
+
+    def insert(self, model, objects, **kwargs):
+        """bulk_create пачками, по транзакции на пачку."""
+        batch = []
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                self._flush(model, batch, **kwargs)
+                batch = []
+        if batch:
+            self._flush(model, batch, **kwargs)
+
+    def _flush(self, model, batch, **kwargs):
+        with transaction.atomic():
+            model.objects.bulk_create(batch, **kwargs)
+        self.progress.add(model._meta.model_name, len(batch))
+
+    def new_pks(self, model, before):
+        return model.objects.filter(pk__gt=before).order_by(
+            'pk').values_list('pk', flat=True)
+
+    def last_pk(self, model):
+        return model.objects.order_by('-pk').values_list(
+            'pk', flat=True).first() or 0
+
+    def users(self, count):
+        before = self.last_pk(User)
+        password = make_password(None)
+        self.insert(User, (
+            User(username=f'{self.prefix}{number}', password=password,
+                 first_name=self.rng.choice(WORDS).capitalize())
+            for number in range(count)))
+        user_ids = list(self.new_pks(User, before))
+        # Одни и те же авторы популярны и по подпискам, и по числу постов.
+        self.authors, self.weights = self.ranked(user_ids)
+        return user_ids
+
+    def groups(self, count):
+        before = self.last_pk(Group)
+        self.insert(Group, (
+            Group(title=self.text(1, 3)[:200],
+                  slug=f'{self.prefix}-group-{number}',
+                  description=self.text(5, 30))
+            for number in range(count)))
+        return list(self.new_pks(Group, before))
+
+    def posts(self, count, group_ids):
+        """Посты авторов по закону Ципфа; возвращает id и даты новых постов.
+
+        Id берутся из базы, а не считаются подряд: последовательность
+        может идти с пропусками. Чтобы не держать в памяти миллионы
+        объектов, id и метки времени хранятся в двух массивах array.
+        """
+        before = self.last_pk(Post)
+        pick_date = self.dates()
+
+        def build():
+            for _ in range(count):
+                author = self.rng.choices(self.authors,
+                                          cum_weights=self.weights)[0]
+                group = (self.rng.choice(group_ids)
+                         if group_ids and self.rng.random() < 0.6 else None)
+                pub_date = pick_date()
+                yield Post(author_id=author, group_id=group,
+                           text=self.text(5, 80), pub_date=pub_date,
+                           modified=pub_date)
+        with keep_dates():
+            self.insert(Post, build())
+        ids, stamps = array('q'), array('d')
+        for pk, pub_date in Post.objects.filter(pk__gt=before).order_by(
+                'pk').values_list('pk', 'pub_date').iterator():
+            ids.append(pk)
+            stamps.append(pub_date.timestamp())
+        return ids, stamps
+
+    def comments(self, count, user_ids, posts):
+        ids, stamps = posts
+        if not ids:
+            return
+        pick_date = self.dates()
+
+        def build():
+            for _ in range(count):
+                # Обсуждают в основном свежие посты: ближе к концу.
+                index = int((len(ids) - 1) * self.rng.random() ** 0.3)
+                pub_date = datetime.fromtimestamp(stamps[index],
+                                                  dt_timezone.utc)
+                # Комментарий не раньше своего поста.
+                created = max(pick_date(), pub_date + timedelta(
+                    seconds=self.rng.uniform(0, 3600)))
+                yield Comment(post_id=ids[index],
+                              author_id=self.rng.choice(user_ids),
+                              text=self.text(1, 20), created=created)
+        with keep_dates():
+            self.insert(Comment, build())
+
+    def follows(self, count, user_ids):
+        """Подписки с подписчиками по степенному закону.
+
+        Повторы и подписки на себя отбрасываются, поэтому итоговое число
+        может быть немного меньше count.
+        """
+        if len(user_ids) < 2:
+            return
+
+        def build():
+            for _ in range(count):
+                author = self.rng.choices(self.authors,
+                                          cum_weights=self.weights)[0]
+                user = self.rng.choice(user_ids)
+                if user != author:
+                    yield Follow(user_id=user, author_id=author)
+        self.insert(Follow, build(), ignore_conflicts=True)
+
+
+def generate(users, groups, posts, comments, follows, progress, seed=0,
+             batch_size=5000, prefix='user', days=365, end=None):
+    seeder = Seeder(seed, batch_size, progress, prefix=prefix, days=days,
+                    end=end)
+    user_ids = seeder.users(users)
+    if not user_ids:
+        return
+    group_ids = seeder.groups(groups)
+    new_posts = seeder.posts(posts, group_ids)
+    seeder.comments(comments, user_ids, new_posts)
+    seeder.follows(follows, user_ids)
+
+
+@contextmanager
+def temporary_database(posts, progress, seed=0):
+    """Временная тестовая база, заполненная generate() на posts постов.
+
+    SQLite-база создаётся в файле, а не в памяти: общая in-memory база
+    блокирует таблицы целиком и искажает замеры с несколькими потоками.
+    Кэш на это время тоже свой: страницы и поколения временной базы не
+    должны попасть в общий кэш сайта.
+    """
+    with caches.isolated():
+        with _database(posts, progress, seed):
+            yield
+
+
+@contextmanager
+def _database(posts, progress, seed):
+    test_settings = connection.settings_dict['TEST']
+    path = None
+    if connection.vendor == 'sqlite' and not test_settings.get('NAME'):
+        descriptor, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(descriptor)
+        test_settings['NAME'] = path
+    old_name = connection.creation.create_test_db(
+        verbosity=0, autoclobber=True)
+    try:
+        generate(users=max(posts // 20, 2), groups=20, posts=posts,
+                 comments=posts, follows=posts, progress=progress, seed=seed)
+        rebuild_derived()
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        if path is not None:
+            test_settings['NAME'] = None
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,116 @@
+from django.db import transaction
+from django.db.models.signals import (post_delete, post_init, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from . import (caching, counters, following, objects, search, thumbnails,
+               timelines)
+from .models import Comment, Follow, Group, Post, User
+
+
+@receiver(post_init, sender=Post)
+def post_loaded(sender, instance, **kwargs):
+    instance._loaded_group_id = instance.group_id
+    instance._loaded_image = instance.image.name
+
+
+@receiver(pre_save, sender=Post)
+def post_saving(sender, instance, raw=False, **kwargs):
+    if not raw and instance.image.name != instance._loaded_image:
+        instance.image_variants = ''
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw=False, **kwargs):
+    caching.bump(*caching.post_generations(instance))
+    objects.invalidate(instance)
+    instance._loaded_group_id = instance.group_id
+    if not raw:
+        search.index_post(instance.pk)
+    image = instance.image.name
+    if image and image != instance._loaded_image and not raw:
+        transaction.on_commit(lambda: thumbnails.schedule(image))
+    instance._loaded_image = image
+    if created and not raw:
+        counters.bump(instance.author_id, 'posts', 1)
+        timelines.fan_out(instance)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    caching.bump(*caching.post_generations(instance))
+    objects.invalidate(instance)
+    counters.bump(instance.author_id, 'posts', -1)
+    search.remove_post(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, raw=False, **kwargs):
+    caching.bump(f'post:{instance.post_id}')
+    if created and not raw:
+        counters.bump_comments(instance.post_id, 1)
+        objects.forget(Post, instance.post_id)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    caching.bump(f'post:{instance.post_id}')
+    counters.bump_comments(instance.post_id, -1)
+    objects.forget(Post, instance.post_id)
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, raw=False, **kwargs):
+    caching.bump('groups', f'group:{instance.pk}')
+    objects.invalidate(instance)
+    if not raw:
+        search.index_group(instance.pk)
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleting(sender, instance, **kwargs):
+    # Посты отвяжутся от группы через SET_NULL, минуя сигналы.
+    search.clear_group(instance.pk)
+
+
+@receiver(post_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    caching.bump('groups', f'group:{instance.pk}')
+    objects.invalidate(instance)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, raw=False, update_fields=None,
+               **kwargs):
+    objects.invalidate(instance)
+    if created or raw or update_fields == frozenset({'last_login'}):
+        return
+    search.index_author(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    objects.invalidate(instance)
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, created, raw=False, **kwargs):
+    caching.bump(f'profile:{instance.author_id}',
+                 f'profile:{instance.user_id}')
+    following.invalidate(instance.user_id)
+    if created and not raw:
+        counters.bump(instance.author_id, 'followers', 1)
+        counters.bump(instance.user_id, 'following', 1)
+        timelines.update_celebrity(instance.author_id)
+        timelines.backfill(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    caching.bump(f'profile:{instance.author_id}',
+                 f'profile:{instance.user_id}')
+    following.invalidate(instance.user_id)
+    counters.bump(instance.author_id, 'followers', -1)
+    counters.bump(instance.user_id, 'following', -1)
+    timelines.trim(instance)
+    timelines.update_celebrity(instance.author_id)
@@ -0,0 +1,75 @@
+import hashlib
+
+from django import template
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from core import singleflight
+from posts import thumbnails
+from posts.forms import CommentForm
+
+register = template.Library()
+
+CARD_TEMPLATE = 'includes/post_card.html'
+
+
+def card_key(post):
+    """Ключ карточки меняется вместе с постом, именем автора и группой."""
+    group = post.group
+    stamp = '|'.join(str(value) for value in (
+        post.text, post.image.name, post.image_variants,
+        post.pub_date.isoformat(),
+        post.author.username, post.author.get_full_name(),
+        group and group.slug, group and group.title,
+    ))
+    digest = hashlib.md5(stamp.encode()).hexdigest()
+    return f'card:{post.pk}:{digest}'
+
+
+@register.simple_tag
+def post_cards(posts):
+    """Пары (пост, HTML карточки) для страницы ленты.
+
+    Готовые карточки читаются из кэша одним get_many, недостающие
+    рендерятся и сохраняются одним set_many. Карточку, которую уже
+    рендерит параллельный запрос, лучше дождаться, чем рендерить снова.
+    """
+    posts = {card_key(post): post for post in posts}
+
+    def render(keys):
+        return {key: render_to_string(CARD_TEMPLATE, {'post': posts[key]})
+                for key in keys}
+
+    cards = singleflight.fetch_many(list(posts), render,
+                                    settings.CARD_CACHE_TIMEOUT)
+    return [(post, mark_safe(cards[key])) for key, post in posts.items()]
+
+
+@register.inclusion_tag('posts/includes/comment_form.html',
+                        takes_context=True)
+def comment_form(context, post_id):
+    """Форма комментария для личного фрагмента страницы поста.
+
+    Гостю форма не выводится, но остаётся в контексте фрагмента.
+    """
+    return {'form': CommentForm(), 'post_id': post_id,
+            'user': context.get('user'),
+            'csrf_token': context.get('csrf_token')}
+
+
+@register.inclusion_tag('includes/post_image.html')
+def post_image(post):
+    """Картинка поста: srcset по готовым вариантам или пустая рамка.
+
+    Варианты записывает в пост фоновый пул миниатюр, шаблон их только
+    читает. Пока их нет, карточка показывает рамку нужных пропорций, а
+    картинка ставится в пул (повторно не ставится).
+    """
+    context = {'post': post, 'sizes': settings.IMAGE_VARIANT_SIZES,
+               'aspect': settings.IMAGE_VARIANT_ASPECT}
+    if post.image and post.image_variants:
+        context.update(thumbnails.srcsets(post))
+    elif post.image:
+        thumbnails.schedule(post.image.name)
+    return context
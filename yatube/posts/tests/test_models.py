@@ -1,5 +1,22 @@
-from django.test import TestCase
-from ..models import Group, Post, User, Comment, Follow
+import os
+import tempfile
+from datetime import datetime, timezone
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.http import Http404
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+
+from core import singleflight
+
+from .. import caching, counters, following, objects, seeding, transfer
+from ..models import (Group, Post, User, Comment, Follow, TimelineEntry,
+                      UserCounters)
 
 length: int = 15
 
@@ -39,3 +56,266 @@ class TaskModelTest(TestCase):
 
     def test_models_have_correct_object_names_follow(self):
         self.assertEqual(str(self.follow), self.follow.user.username)
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='test_user')
+        cls.author = User.objects.create_user(username='test_author')
+
+    def test_counters_follow_writes(self):
+        """Счётчики меняются при создании и удалении объектов."""
+        post = Post.objects.create(author=self.author, text='Текст')
+        comment = Comment.objects.create(
+            post=post, author=self.user, text='Комментарий')
+        follow = Follow.objects.create(user=self.user, author=self.author)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        counters = UserCounters.objects.get(user=self.author)
+        self.assertEqual((counters.posts, counters.followers), (1, 1))
+        self.assertEqual(UserCounters.objects.get(user=self.user).following,
+                         1)
+        comment.delete()
+        follow.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        post.delete()
+        counters.refresh_from_db()
+        self.assertEqual((counters.posts, counters.followers), (0, 0))
+
+    def test_reconcile_counters_fixes_drift(self):
+        post = Post.objects.create(author=self.author, text='Текст')
+        Comment.objects.create(post=post, author=self.user, text='-')
+        Follow.objects.create(user=self.user, author=self.author)
+        UserCounters.objects.update(posts=42, followers=42, following=42)
+        Post.objects.update(comments_count=42)
+        UserCounters.objects.filter(user=self.user).delete()
+        call_command('reconcile_counters', batch_size=1, stdout=StringIO())
+        counters = UserCounters.objects.get(user=self.author)
+        self.assertEqual(
+            (counters.posts, counters.followers, counters.following),
+            (1, 1, 0))
+        self.assertEqual(UserCounters.objects.get(user=self.user).following,
+                         1)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+
+
+class CountersTransactionTest(TransactionTestCase):
+    def test_write_rolls_back_with_counters(self):
+        """Запись и её счётчики сохраняются только вместе."""
+        author = User.objects.create_user(username='test_author')
+        with mock.patch.object(counters, 'bump',
+                               side_effect=RuntimeError('сбой')):
+            with self.assertRaises(RuntimeError):
+                Post.objects.create(author=author, text='Текст')
+        self.assertFalse(Post.objects.exists())
+
+
+class TransferTest(TestCase):
+    def test_export_import_round_trip(self):
+        """Выгрузка и загрузка NDJSON сохраняют данные и даты."""
+        author = User.objects.create_user(username='test_author')
+        reader = User.objects.create_user(username='test_reader')
+        group = Group.objects.create(
+            title='Группа', slug='test_group', description='Описание')
+        date = datetime(2020, 1, 2, 3, 4, 5, 678, tzinfo=timezone.utc)
+        post = Post.objects.create(author=author, group=group, text='Текст')
+        Post.objects.filter(pk=post.pk).update(pub_date=date)
+        Comment.objects.create(post=post, author=reader, text='Комментарий')
+        Follow.objects.create(user=reader, author=author)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'dump.ndjson')
+            call_command('export_ndjson', path, stdout=StringIO())
+            Group.objects.all().delete()
+            reader.delete()
+            Post.objects.all().delete()
+            output = StringIO()
+            call_command('import_ndjson', path, batch_size=1, stdout=output)
+        self.assertIn('Создано пользователей: 1.', output.getvalue())
+        post = Post.objects.select_related('group').get(pk=post.pk)
+        self.assertEqual(post.pub_date, date)
+        self.assertEqual(post.group.slug, 'test_group')
+        self.assertEqual(post.comments_count, 1)
+        self.assertTrue(Follow.objects.filter(
+            user__username='test_reader', author=author).exists())
+        self.assertTrue(TimelineEntry.objects.filter(
+            user__username='test_reader', post=post).exists())
+        self.assertEqual(UserCounters.objects.get(user=author).followers, 1)
+
+    def test_reimport_keeps_comments_and_pages(self):
+        """Повторный импорт не дублирует комментарии и не чистит кэш."""
+        author = User.objects.create_user(username='test_author')
+        post = Post.objects.create(author=author, text='Текст')
+        Comment.objects.create(post=post, author=author, text='Комментарий')
+        cache.set('sessions:test', 'value')
+        before = caching.generations([f'post:{post.pk}'])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'dump.ndjson')
+            call_command('export_ndjson', path, stdout=StringIO())
+            for _ in range(2):
+                call_command('import_ndjson', path, stdout=StringIO())
+        self.assertEqual(Comment.objects.count(), 1)
+        self.assertEqual(cache.get('sessions:test'), 'value')
+        self.assertNotEqual(caching.generations([f'post:{post.pk}']),
+                            before)
+
+    def test_forget_cached_writes_one_key(self):
+        """Сброс кэша после импорта — одна запись, сколько бы ни было
+        строк, и она сбрасывает объекты и подписки."""
+        author = User.objects.create_user(username='test_author')
+        reader = User.objects.create_user(username='test_reader')
+        Post.objects.bulk_create(
+            Post(author=author, text=f'Пост {number}')
+            for number in range(50))
+        post = Post.objects.first()
+        objects.get(Post, post.pk)
+        following.followed_ids(reader.pk)
+        Post.objects.filter(pk=post.pk).update(text='Новый текст')
+        Follow.objects.bulk_create([Follow(user=reader, author=author)])
+        with mock.patch.object(caching, '_renew',
+                               wraps=caching._renew) as renew:
+            transfer.forget_cached()
+        self.assertEqual(
+            sum(len(args[0]) for args, _ in renew.call_args_list), 1)
+        self.assertEqual(objects.get(Post, post.pk).text, 'Новый текст')
+        self.assertEqual(following.followed_ids(reader.pk), {author.pk})
+
+    def test_keep_dates_restores_fields_after_error(self):
+        field = Post._meta.get_field('pub_date')
+        with self.assertRaises(ValueError):
+            with transfer.keep_dates():
+                self.assertFalse(field.auto_now_add)
+                raise ValueError
+        self.assertTrue(field.auto_now_add)
+        self.assertFalse(field.auto_now)
+
+
+class SeedDataTest(TestCase):
+    def seed(self, **options):
+        call_command('seed_data', users=30, groups=3, posts=200,
+                     comments=100, follows=150, batch_size=64,
+                     end_date=datetime(2021, 6, 1).date(),
+                     stdout=StringIO(), **options)
+        return list(Post.objects.order_by('pk').values_list(
+            'author__username', 'group__slug', 'text', 'pub_date'))
+
+    def test_seed_data_is_reproducible(self):
+        """Один seed даёт одни и те же данные, счётчики пересчитаны."""
+        posts = self.seed(seed=7)
+        self.assertEqual(len(posts), 200)
+        self.assertEqual(Comment.objects.count(), 100)
+        self.assertTrue(Follow.objects.exists())
+        top = UserCounters.objects.order_by('-posts').first()
+        self.assertEqual(top.posts, Post.objects.filter(
+            author=top.user_id).count())
+        # Степенной закон: самый активный автор пишет заметно больше
+        # среднего.
+        self.assertGreater(top.posts, 200 / 30 * 2)
+        Post.objects.all().delete()
+        User.objects.all().delete()
+        Group.objects.all().delete()
+        self.assertEqual(self.seed(seed=7), posts)
+        Post.objects.all().delete()
+        User.objects.all().delete()
+        Group.objects.all().delete()
+        self.assertNotEqual(self.seed(seed=8), posts)
+
+    def test_comments_follow_their_posts(self):
+        """Комментарии ссылаются на настоящие посты и не старше их."""
+        self.seed(seed=7)
+        self.assertFalse(Comment.objects.filter(
+            created__lt=F('post__pub_date')).exists())
+        self.assertFalse(Comment.objects.exclude(
+            post_id__in=Post.objects.values('pk')).exists())
+
+
+class TemporaryDatabaseTest(TestCase):
+    def test_live_cache_untouched(self):
+        """Временная база для замеров не пишет в кэш сайта."""
+        cache.set('live', 'site')
+        before = caching.generations(['posts', 'groups'])
+        creation = connection.creation
+        with mock.patch.object(creation, 'create_test_db'), \
+                mock.patch.object(creation, 'destroy_test_db'), \
+                mock.patch.object(seeding, 'generate'):
+            with seeding.temporary_database(10, progress=None):
+                self.assertIsNone(cache.get('live'))
+                cache.set('live', 'temporary')
+        self.assertEqual(cache.get('live'), 'site')
+        self.assertEqual(caching.generations(['posts', 'groups']), before)
+
+
+class ObjectCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(title='Группа', slug='group')
+        cls.post = Post.objects.create(author=cls.user, text='Текст',
+                                       group=cls.group)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_lookups_read_through(self):
+        objects.get(Post, self.post.pk)
+        objects.get(Group, slug='group')
+        objects.get(User, username='author')
+        with self.assertNumQueries(0):
+            self.assertEqual(objects.get(Post, self.post.pk).text, 'Текст')
+            self.assertEqual(objects.get(Group, slug='group'), self.group)
+            self.assertEqual(objects.get(User, username='author'),
+                             self.user)
+        self.assertIsNone(objects.get(User, username='missing'))
+        with self.assertRaises(Http404):
+            objects.get_or_404(Group, slug='missing')
+
+    def test_get_many_loads_misses_in_one_query(self):
+        other = Post.objects.create(author=self.user, text='Другой')
+        objects.get(Post, self.post.pk)
+        with self.assertNumQueries(1):
+            found = objects.get_many(Post, [self.post.pk, other.pk, 0])
+        self.assertEqual(set(found), {self.post.pk, other.pk})
+        with self.assertNumQueries(0):
+            objects.get_many(Post, [self.post.pk, other.pk])
+
+    def test_signals_invalidate(self):
+        objects.get(User, username='author')
+        self.user.username = 'renamed'
+        self.user.save()
+        self.assertIsNone(objects.get(User, username='author'))
+        self.assertEqual(objects.get(User, username='renamed'), self.user)
+        objects.get(Post, self.post.pk)
+        Comment.objects.create(post=self.post, author=self.user, text='-')
+        self.assertEqual(objects.get(Post, self.post.pk).comments_count, 1)
+        self.group.delete()
+        self.assertIsNone(objects.get(Group, slug='group'))
+
+    def test_read_before_invalidation_is_not_served(self):
+        """Копия, прочитанная до правки и записанная после сброса,
+        лежит под прежним поколением и не читается."""
+        token = objects.tokens(Post, [self.post.pk])[self.post.pk]
+        stale = Post.objects.get(pk=self.post.pk)
+        Post.objects.filter(pk=self.post.pk).update(text='Новый текст')
+        objects.forget(Post, self.post.pk)
+        cache.set(objects.cache_key(Post, self.post.pk, token),
+                  singleflight.Entry(stale, 0, None))
+        self.assertEqual(objects.get(Post, self.post.pk).text, 'Новый текст')
+
+    def test_natural_keys_are_hashed(self):
+        key = objects.natural_cache_key(Group, 'Тестовый слаг')
+        self.assertTrue(key.isascii())
+        self.assertNotIn(' ', key)
+
+    def test_edit_keeps_counters_of_cached_copy(self):
+        objects.get(Post, self.post.pk)
+        Post.objects.filter(pk=self.post.pk).update(comments_count=5)
+        self.client.force_login(self.user)
+        self.client.post(
+            reverse('posts:post_edit', kwargs={'post_id': self.post.pk}),
+            {'text': 'Правка'})
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertEqual(post.text, 'Правка')
+        self.assertEqual(post.comments_count, 5)
@@ -1,8 +1,33 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from io import BytesIO, StringIO
+from unittest import mock
+
 from django import forms
-from django.test import Client, TestCase
-from django.urls import reverse
-from ..models import Group, Post, User, Comment, Follow
-from django.core.cache import cache
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import (Client, RequestFactory, TestCase,
+                         TransactionTestCase, override_settings)
+from django.http import HttpResponse
+from django.urls import resolve, reverse
+from PIL import Image
+
+from core import counts, holes, metrics, singleflight, slow_queries
+from core.caches import FileCache, TieredCache
+from core.paginators import CursorPaginator
+
+from .. import (benchmarks, caching, counters, following, loadtest,
+                query_plans, thumbnails, timelines)
+from ..models import Group, Post, User, Comment, Follow, TimelineEntry
+from django.core.cache import cache, caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from http import HTTPStatus
 
 amount_posts: int = 10
@@ -25,6 +50,7 @@ class PostsViewsTests(TestCase):
 
     @classmethod
     def setUp(self):
+        cache.clear()
         self.guest_client = Client()
         self.user = User.objects.get(username='test_user')
         self.authorized_client = Client()
@@ -162,20 +188,93 @@ class PostsViewsTests(TestCase):
         self.assertEqual(len(context_unfollow['page_obj']), 0)
 
     def test_cache_index(self):
+        """Главная отдаётся из кэша, пока посты не менялись."""
         cache.clear()
         post_1 = Post.objects.create(author=self.user,
                                      text='Текст_1')
-        response = self.authorized_client.get(reverse('posts:index'))
+        response = self.guest_client.get(reverse('posts:index'))
         self.assertEqual(response.context['page_obj'][0].text, post_1.text)
+        with self.assertNumQueries(0):
+            response_2 = self.guest_client.get(reverse('posts:index'))
+        self.assertEqual(response.content, response_2.content)
         post_2 = Post.objects.create(author=self.user,
                                      text='Текст_2')
-        post_1.delete()
-        response_2 = self.authorized_client.get(reverse('posts:index'))
-        self.assertEqual(response.content, response_2.content)
-        self.assertNotEqual(response.context['page_obj'][0].text, post_2.text)
-        cache.clear()
-        response_3 = self.authorized_client.get(reverse('posts:index'))
+        response_3 = self.guest_client.get(reverse('posts:index'))
         self.assertEqual(response_3.context['page_obj'][0].text, post_2.text)
+        post_2.delete()
+        response_4 = self.guest_client.get(reverse('posts:index'))
+        self.assertEqual(response_4.context['page_obj'][0].text, post_1.text)
+
+    def test_cache_invalidated_by_related_writes(self):
+        """Комментарии, группы и подписки сбрасывают свои страницы."""
+        detail = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        group = reverse('posts:group_posts', kwargs={'slug': 'test-slug'})
+        profile = reverse('posts:profile', kwargs={'username': 'test_user'})
+        for url in (detail, group, profile):
+            self.guest_client.get(url)
+        Comment.objects.create(post=self.post, author=self.user,
+                               text='Новый комментарий')
+        self.assertContains(self.guest_client.get(detail),
+                            'Новый комментарий')
+        group_obj = Group.objects.get(pk=self.group.pk)
+        group_obj.title = 'Новое название'
+        group_obj.save()
+        self.assertContains(self.guest_client.get(group), 'Новое название')
+        self.assertContains(self.guest_client.get(detail), 'Новое название')
+        follower = User.objects.create_user(username='follower')
+        Follow.objects.create(user=follower, author=self.user)
+        self.assertContains(self.guest_client.get(profile), 'Подписчиков: 1')
+
+    def test_write_during_render_is_not_cached_as_fresh(self):
+        """Запись во время рендера сбрасывает только что собранную
+        страницу: она сохранена под прежними поколениями."""
+        rendered = []
+
+        def view(request):
+            rendered.append(request.path)
+            if len(rendered) == 1:
+                caching.bump('race')
+            return HttpResponse()
+        cached = caching.cache_page_by_generation(
+            lambda request: ('race',))(view)
+        request = RequestFactory().get('/race/')
+        request.user = AnonymousUser()
+        request.resolver_match = resolve(reverse('posts:index'))
+        for _ in range(3):
+            cached(request)
+        self.assertEqual(len(rendered), 2)
+
+    def test_stale_page_keeps_its_validators(self):
+        """Прежняя страница, отданная во время чужого пересчёта, несёт
+        свой ETag: повторная проверка с ним не получает 304."""
+        cache.clear()
+        url = reverse('posts:index')
+        response = self.guest_client.get(url)
+        old_etag = response['ETag']
+        key = caching.page_key(response.wsgi_request)
+        Post.objects.create(author=self.user, text='Свежий пост')
+        cache.add(singleflight.lock_key(key), True)
+        stale = self.guest_client.get(url)
+        self.assertNotContains(stale, 'Свежий пост')
+        self.assertEqual(stale['ETag'], old_etag)
+        cache.delete(singleflight.lock_key(key))
+        response = self.guest_client.get(url, HTTP_IF_NONE_MATCH=old_etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertContains(response, 'Свежий пост')
+
+    def test_post_cards_rendered_from_cache(self):
+        """Карточки постов берутся из кэша и обновляются после правки."""
+        url = reverse('posts:group_posts', kwargs={'slug': 'test-slug'})
+        self.guest_client.get(url)
+        caching.bump(f'group:{self.group.pk}')
+        response = self.guest_client.get(url)
+        self.assertTemplateNotUsed(response, 'includes/post_card.html')
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Новый текст'
+        post.save()
+        response = self.guest_client.get(url)
+        self.assertTemplateUsed(response, 'includes/post_card.html')
+        self.assertContains(response, 'Новый текст')
 
 
 class PaginatorViewsTest(TestCase):
@@ -219,6 +318,175 @@ class PaginatorViewsTest(TestCase):
                                  amount_posts)
 
 
+class CursorPaginatorViewsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='test_user')
+        Post.objects.bulk_create(
+            Post(author=cls.user, text=f'Текст{i}')
+            for i in range(test_amposts + 5))
+
+    def setUp(self):
+        self.guest_client = Client()
+
+    def test_cursor_pages_walk_whole_feed(self):
+        """Курсоры next/previous обходят ленту без пропусков и повторов."""
+        url = reverse('posts:profile', kwargs={'username': 'test_user'})
+        expected = list(Post.objects.filter(author=self.user)
+                        .order_by('-pub_date', '-pk'))
+        seen = []
+        pages = []
+        cursor = ''
+        while True:
+            response = self.guest_client.get(url, {'cursor': cursor})
+            page_obj = response.context['page_obj']
+            pages.append(list(page_obj))
+            seen.extend(page_obj)
+            cursor = page_obj.next_cursor
+            if not cursor:
+                break
+        self.assertEqual(seen, expected)
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        response = self.guest_client.get(
+            url, {'cursor': page_obj.previous_cursor})
+        self.assertEqual(list(response.context['page_obj']), pages[1])
+
+    def test_cursor_page_skips_count(self):
+        """Страница по курсору не выполняет COUNT(*) и OFFSET."""
+        cache.clear()
+        url = reverse('posts:index')
+        cursor = self.guest_client.get(url).context['page_obj'].next_cursor
+        with CaptureQueriesContext(connection) as queries:
+            self.guest_client.get(url, {'cursor': cursor})
+        for query in queries:
+            self.assertNotIn('COUNT(', query['sql'])
+            self.assertNotIn('OFFSET', query['sql'])
+
+    def test_broken_cursor_returns_first_page(self):
+        url = reverse('posts:profile', kwargs={'username': 'test_user'})
+        response = self.guest_client.get(url, {'cursor': 'мусор'})
+        self.assertEqual(len(response.context['page_obj']), amount_posts)
+        self.assertEqual(response.context['page_obj'].previous_cursor, '')
+
+    def test_numbered_pages_reuse_cached_count(self):
+        """Повторный ?page= берёт число постов из кэша без COUNT(*)."""
+        cache.clear()
+        url = reverse('posts:index')
+        self.guest_client.get(url, {'page': 2})
+        queries = []
+        with connection.execute_wrapper(
+                lambda execute, sql, *args: queries.append(sql)
+                or execute(sql, *args)):
+            response = self.guest_client.get(url, {'page': 3})
+        self.assertEqual(len(response.context['page_obj']), 5)
+        self.assertFalse([sql for sql in queries if 'COUNT(' in sql])
+
+    def test_page_links_are_elided(self):
+        """Шаблон выводит окно вокруг текущей страницы, а не все номера."""
+        paginator = CursorPaginator(Post.objects.all(), 10, count=10000)
+        self.assertEqual(
+            list(paginator.elided_page_range(500)),
+            [1, '…', 498, 499, 500, 501, 502, '…', 1000])
+        self.assertEqual(list(paginator.elided_page_range(2)),
+                         [1, 2, 3, 4, '…', 1000])
+        self.assertEqual(list(paginator.elided_page_range(1000)),
+                         [1, '…', 998, 999, 1000])
+        self.assertEqual(list(CursorPaginator(
+            Post.objects.all(), 10, count=50).elided_page_range(3)),
+            [1, 2, 3, 4, 5])
+        cache.clear()
+        response = self.guest_client.get(reverse('posts:index'),
+                                         {'page': 2})
+        self.assertContains(response, '?page=3')
+        self.assertEqual(response.context['page_obj'].page_links, [1, 2, 3])
+
+    def test_first_page_links_numbered_pages(self):
+        """С первой страницы ленты можно перейти на нумерованные."""
+        cache.clear()
+        response = self.guest_client.get(reverse('posts:index'))
+        self.assertEqual(response.context['page_obj'].page_links, [1, 2, 3])
+        self.assertContains(response, '?page=2')
+
+    def test_profile_pages_use_post_counter(self):
+        """Число страниц профиля берётся из счётчика автора."""
+        counters.reconcile()
+        cache.clear()
+        url = reverse('posts:profile', kwargs={'username': 'test_user'})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.guest_client.get(url, {'page': 3})
+        self.assertEqual(len(response.context['page_obj']), 5)
+        self.assertEqual(response.context['page_obj'].page_links, [1, 2, 3])
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'COUNT(' in query['sql']])
+
+    def test_stale_count_refreshes_once_in_pool(self):
+        name = 'test-stale'
+        self.addCleanup(counts._refreshing.discard, name)
+        with mock.patch.object(counts, '_executor') as executor:
+            counts.refresh_in_background(name, Post.objects.all())
+            counts.refresh_in_background(name, Post.objects.all())
+        executor.submit.assert_called_once_with(
+            counts._refresh, name, mock.ANY)
+
+
+class QueryCountTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_superuser(
+            username='admin', email='admin@test.ru', password='pass')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',)
+        cls.post = Post.objects.create(
+            author=cls.user, text='Текст', group=cls.group)
+        Follow.objects.create(user=cls.user, author=cls.user)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def add_rows(self, number):
+        """Посты, комментарии и подписки от разных авторов и групп."""
+        for i in range(number):
+            author = User.objects.create_user(username=f'author{i}')
+            group = Group.objects.create(
+                title=f'Группа{i}', slug=f'group{i}', description='-')
+            Post.objects.create(author=author, text='Текст', group=group)
+            Post.objects.create(author=author, text='Текст', group=self.group)
+            Post.objects.create(author=self.user, text='Текст', group=group)
+            Comment.objects.create(post=self.post, author=author, text='-')
+            Follow.objects.create(user=self.user, author=author)
+            Follow.objects.create(user=author, author=self.user)
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.authorized_client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return len(queries)
+
+    def test_pages_run_fixed_number_of_queries(self):
+        """Число запросов не зависит от количества объектов на странице."""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_posts', kwargs={'slug': 'test-slug'}),
+            reverse('posts:profile', kwargs={'username': 'admin'}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+            reverse('posts:follow_index'),
+            reverse('admin:posts_post_changelist'),
+            reverse('admin:posts_comment_changelist'),
+            reverse('admin:posts_follow_changelist'),
+        )
+        expected = {url: self.count_queries(url) for url in urls}
+        self.add_rows(6)
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.count_queries(url), expected[url])
+
+
 class CommentFormTests(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -342,3 +610,923 @@ class Testfollow(TestCase):
         self.client.login(username='testfollow1', password='pass')
         response = self.response_get('posts:follow_index')
         self.assertNotIn(post, response.context['page_obj'].object_list)
+
+    def test_follow_backfills_and_unfollow_trims_timeline(self):
+        """Подписка заполняет ленту, отписка её очищает."""
+        following = User.objects.create(username='following1')
+        post = Post.objects.create(author=following, text=self.text)
+        self.response_post('posts:profile_follow',
+                           rev_args={'username': following})
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.user, post=post).exists())
+        self.response_post('posts:profile_unfollow',
+                           rev_args={'username': following})
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user).exists())
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_celebrity_posts_read_on_request(self):
+        """ Посты автора с большим числом подписчиков не рассылаются,
+        но видны в ленте.
+        """
+        cache.clear()
+        following = User.objects.create(username='following1')
+        Follow.objects.create(user=self.user, author=following)
+        post = Post.objects.create(author=following, text=self.text)
+        self.assertFalse(TimelineEntry.objects.filter(post=post).exists())
+        response = self.response_get('posts:follow_index')
+        self.assertIn(post, response.context['page_obj'].object_list)
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=2)
+    def test_former_celebrity_posts_stay_in_feed(self):
+        """Посты времён «знаменитости» дописываются в ленты при отписке,
+        после которой автор перестаёт быть «знаменитостью»."""
+        cache.clear()
+        author = User.objects.create(username='former_celebrity')
+        other = User.objects.create(username='other_reader')
+        Follow.objects.create(user=self.user, author=author)
+        Follow.objects.create(user=other, author=author)
+        self.assertTrue(timelines.is_celebrity(author.pk))
+        post = Post.objects.create(author=author, text=self.text)
+        self.assertIn(post, self.response_get(
+            'posts:follow_index').context['page_obj'].object_list)
+        Follow.objects.filter(user=other).delete()
+        self.assertFalse(timelines.is_celebrity(author.pk))
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.user, post=post).exists())
+        # Вытеснение набора из кэша ничего не теряет: флаг хранится в базе.
+        cache.clear()
+        response = self.response_get('posts:follow_index')
+        self.assertIn(post, response.context['page_obj'].object_list)
+
+    def test_rebuild_recomputes_celebrities(self):
+        """rebuild пересчитывает флаги по счётчикам подписчиков."""
+        author = User.objects.create(username='imported_author')
+        Follow.objects.create(user=self.user, author=author)
+        post = Post.objects.create(author=author, text=self.text)
+        with override_settings(TIMELINE_FANOUT_LIMIT=1):
+            timelines.rebuild()
+            self.assertTrue(timelines.is_celebrity(author.pk))
+            self.assertFalse(TimelineEntry.objects.filter(post=post).exists())
+        timelines.rebuild()
+        self.assertFalse(timelines.is_celebrity(author.pk))
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.user, post=post).exists())
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=2)
+    def test_feed_pages_merge_timeline_and_celebrities(self):
+        """Страницы ленты по курсору сливают записи ленты и посты
+        знаменитостей в общем порядке и не сортируют во временном
+        B-дереве."""
+        cache.clear()
+        celebrity = User.objects.create(username='celebrity')
+        author = User.objects.create(username='author')
+        other = User.objects.create(username='other_reader')
+        for followed in (celebrity, author):
+            Follow.objects.create(user=self.user, author=followed)
+        Follow.objects.create(user=other, author=celebrity)
+        Post.objects.create(author=other, text='Не из ленты')
+        for number in range(25):
+            Post.objects.create(author=(celebrity, author)[number % 3 == 0],
+                                text=f'Пост {number}')
+        expected = list(Post.objects.filter(
+            author__in=(celebrity, author)).order_by('-pub_date', '-pk'))
+        entries = TimelineEntry.objects.filter(user=self.user)
+        self.assertEqual(
+            {(entry.post_id, entry.pub_date) for entry in entries},
+            {(post.pk, post.pub_date) for post in expected
+             if post.author == author})
+        url = reverse('posts:follow_index')
+        pages = []
+        cursor = ''
+        with CaptureQueriesContext(connection) as queries:
+            while True:
+                response = self.client.get(url, {'cursor': cursor})
+                page_obj = response.context['page_obj']
+                pages.append(list(page_obj))
+                cursor = page_obj.next_cursor
+                if not cursor:
+                    break
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        response = self.client.get(url, {'cursor': page_obj.previous_cursor})
+        self.assertEqual(list(response.context['page_obj']), pages[1])
+        response = self.client.get(url, {'page': 2})
+        self.assertEqual(list(response.context['page_obj']), pages[1])
+        for query in queries.captured_queries:
+            if 'posts_' not in query['sql']:
+                continue
+            found = query_plans.problems(query_plans.explain(query['sql'], ()))
+            self.assertNotIn('временная сортировка',
+                             [problem for problem, line in found],
+                             query['sql'])
+
+    def test_follow_state_cached_per_user(self):
+        """Состояние подписки читается из кэша и сбрасывается при смене."""
+        cache.clear()
+        author = User.objects.create(username='following2')
+        url = reverse('posts:profile', kwargs={'username': 'following2'})
+        self.assertNotContains(self.client.get(url), 'Отписаться')
+        response = self.response_get('posts:profile_follow',
+                                     rev_args={'username': author})
+        self.assertContains(response, 'Отписаться')
+        request = RequestFactory().get('/')
+        request.user = self.user
+        with self.assertNumQueries(0):
+            self.assertIn(author.pk, following.request_followed_ids(request))
+        response = self.response_get('posts:profile_unfollow',
+                                     rev_args={'username': author})
+        self.assertContains(response, 'Подписаться')
+        self.assertNotContains(response, 'Отписаться')
+
+
+class SearchViewTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(
+            username='test_user', first_name='Лев', last_name='Толстой')
+        cls.group = Group.objects.create(
+            title='Классика',
+            slug='classic',
+            description='Тестовое описание',)
+        cls.post = Post.objects.create(
+            author=cls.user, text='Все счастливые семьи похожи друг на друга',
+            group=cls.group)
+        Post.objects.create(author=cls.user, text='Совсем другой текст')
+
+    def setUp(self):
+        self.guest_client = Client()
+
+    def found(self, query):
+        response = self.guest_client.get(reverse('posts:search'),
+                                         {'q': query})
+        return [post.pk for post in response.context['posts']]
+
+    def test_search_by_text_group_and_author(self):
+        """Поиск находит пост по тексту, группе и имени автора."""
+        for query in ('счастливые семьи', 'СЕМЬ', 'классика'):
+            with self.subTest(query=query):
+                self.assertEqual(self.found(query), [self.post.pk])
+        self.assertEqual(len(self.found('Толстой')), 2)
+        self.assertEqual(self.found('"несуществующее OR'), [])
+
+    def test_search_index_follows_writes(self):
+        """Индекс обновляется при правке поста, группы и удалении."""
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Анна Каренина'
+        post.save()
+        self.assertEqual(self.found('каренина'), [post.pk])
+        self.assertEqual(self.found('семьи'), [])
+        Group.objects.filter(pk=self.group.pk).get().delete()
+        self.assertEqual(self.found('классика'), [])
+        post.delete()
+        self.assertEqual(self.found('каренина'), [])
+
+    def test_admin_search_uses_index(self):
+        admin = User.objects.create_superuser(
+            username='admin', email='admin@test.ru', password='pass')
+        self.guest_client.force_login(admin)
+        response = self.guest_client.get(
+            reverse('admin:posts_post_changelist'), {'q': 'семьи'})
+        result_list = response.context['cl'].result_list
+        self.assertEqual([post.pk for post in result_list], [self.post.pk])
+
+    def test_rebuild_search_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM posts_post_fts')
+        self.assertEqual(self.found('семьи'), [])
+        call_command('rebuild_search_index', batch_size=1, stdout=StringIO())
+        self.assertEqual(self.found('семьи'), [self.post.pk])
+
+
+class ThumbnailViewsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.media = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media.enable()
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='test_user')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        thumbnails.wait()
+        cls.media.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    def setUp(self):
+        image = BytesIO()
+        Image.new('RGB', (1200, 800)).save(image, 'JPEG')
+        self.post = Post.objects.create(
+            author=self.user, text='Текст',
+            image=SimpleUploadedFile('big.jpg', image.getvalue(),
+                                     content_type='image/jpeg'))
+
+    def test_template_does_not_resize_images(self):
+        """Пока вариантов нет, шаблон не режет картинку и не отдаёт
+        оригинал, а ставит её в пул."""
+        cache.clear()
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        with mock.patch.object(thumbnails, 'schedule') as schedule:
+            response = self.client.get(url)
+        schedule.assert_called_with(self.post.image.name)
+        self.assertNotContains(response, self.post.image.url)
+        self.assertContains(response, 'aspect-ratio: 960 / 339')
+        thumbnails.generate(self.post.image.name)
+        cache.clear()
+        response = self.client.get(url)
+        self.assertNotContains(response, self.post.image.url)
+        self.assertContains(response, '/media/cache/')
+
+    def test_responsive_variants_recorded(self):
+        """Готовые варианты записываются в пост и выводятся в srcset."""
+        thumbnails.generate(self.post.image.name)
+        cache.clear()
+        response = self.client.get(reverse('posts:index'))
+        post = Post.objects.get(pk=self.post.pk)
+        self.assertTrue(post.image_variants)
+        self.assertContains(response, 'loading="lazy"')
+        for width in settings.IMAGE_VARIANT_WIDTHS:
+            self.assertContains(response, f' {width}w')
+        post.image = SimpleUploadedFile(
+            'other.jpg', self.post.image.open().read(),
+            content_type='image/jpeg')
+        post.save()
+        post.refresh_from_db()
+        self.assertEqual(post.image_variants, '')
+
+    def test_variants_recorded_by_pool_not_by_request(self):
+        """GET не пишет в БД; готовые варианты сбрасывают страницы."""
+        url = reverse('posts:index')
+        with mock.patch.object(thumbnails, 'schedule') as schedule:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+        schedule.assert_called_with(self.post.image.name)
+        self.assertFalse([query for query in queries.captured_queries
+                          if not query['sql'].startswith('SELECT')])
+        self.assertNotContains(response, 'srcset')
+        thumbnails.generate(self.post.image.name)
+        response = self.client.get(url)
+        for width in settings.IMAGE_VARIANT_WIDTHS:
+            self.assertContains(response, f' {width}w')
+
+
+class BenchmarkViewsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        group = Group.objects.create(title='Группа', slug='group')
+        Post.objects.create(author=cls.author, group=group, text='Текст')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def test_benchmark_reports_every_read_view(self):
+        output = tempfile.NamedTemporaryFile(suffix='.json', delete=False)
+        output.close()
+        self.addCleanup(os.remove, output.name)
+        call_command('benchmark_views', iterations=3, warmup=0,
+                     output=output.name, stderr=StringIO())
+        with open(output.name, encoding='utf-8') as stream:
+            results = json.load(stream)
+        self.assertEqual(set(results), {
+            'index', 'search', 'group_posts', 'profile', 'post_detail',
+            'follow_index', 'post_create', 'post_edit'})
+        for result in results.values():
+            self.assertEqual(result['status'], HTTPStatus.OK)
+            self.assertGreater(result['queries'], 0)
+            self.assertGreater(result['bytes'], 0)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+    def test_measurements_leave_site_cache_alone(self):
+        """Замеры и EXPLAIN чистят свой кэш, а не общий кэш сайта."""
+        cache.clear()
+        cache.set('live', 'site')
+        before = caching.generations(['posts', 'groups'])
+        url = reverse('posts:index')
+        result = benchmarks.measure(Client(), url, 2, warm=False, warmup=1)
+        query_plans.capture(Client(), url)
+        self.assertEqual(cache.get('live'), 'site')
+        self.assertEqual(caching.generations(['posts', 'groups']), before)
+        # Страницы, построенные при замерах, остались в их кэше.
+        self.assertFalse([key for key in caches['shared']._cache
+                          if 'pages:' in key])
+        self.assertEqual(set(result['cache']), {'l1', 'l2'})
+        self.assertGreater(result['cache']['l2']['hits'], 0)
+
+    def test_percentile_uses_nearest_rank(self):
+        values = list(range(1, 21))
+        self.assertEqual(benchmarks.percentile(values, 95), 19)
+        self.assertEqual(benchmarks.percentile(values, 50), 10)
+        self.assertEqual(benchmarks.percentile(values, 100), 20)
+        self.assertEqual(benchmarks.percentile(range(1, 101), 7), 7)
+        self.assertEqual(benchmarks.percentile([5], 99), 5)
+
+    def test_benchmark_fails_on_regression(self):
+        baseline = {'index': {'p50_ms': 0.0, 'p95_ms': 0.0, 'queries': 0}}
+        with tempfile.NamedTemporaryFile(
+                'w', suffix='.json', delete=False) as stream:
+            json.dump(baseline, stream)
+        self.addCleanup(os.remove, stream.name)
+        with self.assertRaisesMessage(CommandError, 'index: queries'):
+            call_command('benchmark_views', iterations=1, warmup=0,
+                         views=['index'], baseline=stream.name,
+                         stdout=StringIO(), stderr=StringIO())
+
+
+class LoadTestSummaryTests(TestCase):
+    def test_summary_counts_errors_and_buckets(self):
+        records = [('index', 200, 3.0), ('index', 200, 40.0),
+                   ('unfollow', 404, 7.0), ('add_comment', 500, 6000.0),
+                   ('post_create', None, 30.0)]
+        summary = loadtest.summarize(records, elapsed=2.0, concurrency=4,
+                                     lock_errors=1)
+        self.assertEqual(summary['requests'], 5)
+        self.assertEqual(summary['throughput_rps'], 2.5)
+        self.assertEqual(summary['error_rate'], 0.4)
+        self.assertEqual(summary['client_error_rate'], 0.2)
+        self.assertEqual(summary['lock_timeout_rate'], 0.2)
+        self.assertEqual(summary['histogram']['<=5'], 1)
+        self.assertEqual(summary['histogram']['>5000'], 1)
+        self.assertEqual(summary['actions']['index']['requests'], 2)
+
+
+class LoadTestRunTests(TransactionTestCase):
+    """Короткий прогон на сервере в этом процессе.
+
+    TransactionTestCase: потоки сервера читают базу своими соединениями
+    и должны видеть данные теста.
+    """
+
+    def test_short_level_against_current_db(self):
+        cache.clear()
+        user = User.objects.create_user(username='reader')
+        group = Group.objects.create(title='Группа', slug='load')
+        for number in range(3):
+            Post.objects.create(author=user, group=group,
+                                text=f'Пост {number}')
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'load.json')
+            call_command('load_test', '--use-current-db',
+                         '--concurrency', '1', '--duration', '0.5',
+                         '--logged-in', '0', '--output', output,
+                         stderr=StringIO())
+            with open(output, encoding='utf-8') as stream:
+                level, = json.load(stream)
+        self.assertEqual(level['concurrency'], 1)
+        self.assertGreater(level['requests'], 0)
+        self.assertEqual(level['error_rate'], 0)
+
+
+class QueryPlanTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        author = User.objects.create_user(username='author')
+        group = Group.objects.create(title='Группа', slug='group')
+        Post.objects.bulk_create(
+            Post(author=author, group=group, text=f'Пост {number}')
+            for number in range(30))
+        Comment.objects.create(post=Post.objects.first(), author=author,
+                               text='Комментарий')
+        call_command('reconcile_counters', stdout=StringIO())
+
+    def test_feeds_use_indexes(self):
+        """Ленты читаются по индексу, без полного прохода и сортировки."""
+        report = query_plans.advise(
+            ['index', 'group_posts', 'profile', 'post_detail'])
+        for name, entries in report.items():
+            for sql, plan, found in entries:
+                with self.subTest(view=name, sql=sql):
+                    self.assertEqual(found, [])
+
+    def test_problems_flag_scans_and_sorts(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Планы в формате SQLite.')
+        self.assertEqual(
+            query_plans.problems(['SCAN posts_post',
+                                  'USE TEMP B-TREE FOR ORDER BY']),
+            [('полный проход', 'SCAN posts_post'),
+             ('временная сортировка', 'USE TEMP B-TREE FOR ORDER BY')])
+        self.assertEqual(query_plans.problems(
+            ['SCAN posts_post USING INDEX post_pub_date_idx']), [])
+
+
+class CommentPaginationTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='commentator')
+        cls.post = Post.objects.create(author=cls.user, text='Вирусный')
+        Comment.objects.bulk_create(
+            Comment(post=cls.post, author=cls.user, text=f'Комментарий {n}')
+            for n in range(45))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_post_detail_renders_first_page_only(self):
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}))
+        comments = response.context['comments']
+        self.assertEqual([comment.text for comment in comments],
+                         [f'Комментарий {n}' for n in range(20)])
+        self.assertContains(response, 'Комментарий 19')
+        self.assertNotContains(response, 'Комментарий 20<')
+        self.assertContains(response, reverse(
+            'posts:post_comments', kwargs={'post_id': self.post.pk}))
+
+    def test_fragment_loads_later_pages(self):
+        url = reverse('posts:post_comments', kwargs={'post_id': self.post.pk})
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}))
+        texts = []
+        cursor = response.context['comments'].next_cursor
+        while cursor:
+            response = self.client.get(url, {'cursor': cursor})
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            self.assertNotContains(response, '<html')
+            page = response.context['comments']
+            self.assertLessEqual(len(page), 20)
+            texts += [comment.text for comment in page]
+            cursor = page.next_cursor
+        self.assertEqual(texts, [f'Комментарий {n}' for n in range(20, 45)])
+        self.assertNotContains(response, 'js-more-comments')
+
+    def test_fragment_of_missing_post_is_not_found(self):
+        post = Post.objects.create(author=self.user, text='Удалённый')
+        post_id = post.pk
+        post.delete()
+        for name in ('posts:post_comments', 'posts:api_post_comments'):
+            url = reverse(name, kwargs={'post_id': post_id})
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+                self.assertIsNone(cache.get(
+                    caching.page_key(response.wsgi_request)))
+
+
+class ApiTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author',
+                                              first_name='Лев')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(title='Группа', slug='group')
+        Post.objects.bulk_create(
+            Post(author=cls.author, group=cls.group, text=f'Пост {number}')
+            for number in range(15))
+        cls.post = Post.objects.order_by('pk').first()
+        Comment.objects.create(post=cls.post, author=cls.reader,
+                               text='Комментарий')
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        call_command('reconcile_counters', stdout=StringIO())
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, name, client=None, data=None, **kwargs):
+        response = (client or self.client).get(
+            reverse(f'posts:{name}', kwargs=kwargs), data)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        return response, response.json()
+
+    def test_feeds_paginate_by_cursor(self):
+        for name, kwargs in (('api_index', {}),
+                             ('api_group_posts', {'slug': 'group'}),
+                             ('api_profile', {'username': 'author'})):
+            with self.subTest(name=name):
+                _, first = self.get(name, **kwargs)
+                self.assertEqual(len(first['results']), 10)
+                self.assertIsNone(first['previous'])
+                _, second = self.get(name, data={'cursor': first['next']},
+                                     **kwargs)
+                self.assertEqual(len(second['results']), 5)
+                self.assertIsNone(second['next'])
+                ids = [post['id'] for post in first['results']
+                       + second['results']]
+                self.assertEqual(len(set(ids)), 15)
+        _, data = self.get('api_profile', username='author')
+        self.assertEqual(data['profile']['posts'], 15)
+        self.assertEqual(data['profile']['followers'], 1)
+
+    def test_comment_count_only_on_post_page(self):
+        """Число комментариев отдаёт только страница поста: её поколение
+        сбрасывает комментарий, а поколения лент — нет."""
+        _, feed = self.get('api_index')
+        self.assertNotIn('comments_count', feed['results'][0])
+        response, data = self.get('api_index',
+                                  data={'fields': 'comments_count'})
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        _, data = self.get('api_post_detail', post_id=self.post.pk)
+        self.assertEqual(data['comments_count'], 1)
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text='Ещё один')
+        _, data = self.get('api_post_detail', post_id=self.post.pk)
+        self.assertEqual(data['comments_count'], 2)
+
+    def test_field_selection(self):
+        _, data = self.get('api_index', data={'fields': 'id,author',
+                                              'limit': 3})
+        self.assertEqual(data['results'][0].keys(), {'id', 'author'})
+        self.assertEqual(data['results'][0]['author'], 'author')
+        self.assertEqual(len(data['results']), 3)
+        response, data = self.get('api_index', data={'fields': 'password'})
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertIn('password', data['error'])
+
+    def test_post_detail_and_missing_post(self):
+        _, data = self.get('api_post_detail', post_id=self.post.pk)
+        self.assertEqual(data['text'], 'Пост 0')
+        self.assertEqual(data['group'], 'group')
+        self.assertIsNone(data['image'])
+        self.assertEqual(data['comments'][0]['author'], 'reader')
+        response, _ = self.get('api_post_detail', post_id=0)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_follow_feed_requires_login(self):
+        response, _ = self.get('api_follow_index')
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+        client = Client()
+        client.force_login(self.reader)
+        _, data = self.get('api_follow_index', client=client)
+        self.assertEqual(len(data['results']), 10)
+
+    def test_api_shares_page_cache_generations(self):
+        _, before = self.get('api_index')
+        with self.assertNumQueries(0):
+            self.get('api_index')
+        Post.objects.create(author=self.author, text='Новый пост')
+        _, after = self.get('api_index')
+        self.assertEqual(after['results'][0]['text'], 'Новый пост')
+        self.assertNotEqual(before, after)
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.post = Post.objects.create(author=cls.author, text='Текст')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_index_revalidates_without_queries(self):
+        url = reverse('posts:index')
+        response = self.client.get(url)
+        etag, modified = response['ETag'], response['Last-Modified']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=modified)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        self.post.text = 'Правка'
+        self.post.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_post_detail_etag_follows_comments(self):
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        Comment.objects.create(post=self.post, author=self.author, text='-')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_logged_in_pages_vary_by_user(self):
+        url = reverse('posts:profile', kwargs={'username': 'author'})
+        anonymous = self.client.get(url)
+        client = Client()
+        client.force_login(self.author)
+        response = client.get(url)
+        self.assertNotEqual(response['ETag'], anonymous['ETag'])
+        self.assertFalse(response.has_header('Last-Modified'))
+        response = client.get(url, HTTP_IF_NONE_MATCH=anonymous['ETag'])
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_missing_objects_still_404(self):
+        response = self.client.get(
+            reverse('posts:group_posts', kwargs={'slug': 'missing'}))
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class TieredCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shared = caches['shared']
+
+    def test_tiers_count_hits_and_misses(self):
+        before = cache.stats()
+        self.assertIsNone(cache.get('tiers:missing'))
+        cache.set('tiers:value', [1, 2])
+        self.assertEqual(cache.get('tiers:value'), [1, 2])
+        self.shared.set('tiers:other', 'общее')
+        self.assertEqual(cache.get('tiers:other'), 'общее')
+        self.assertEqual(cache.get('tiers:other'), 'общее')
+        after = cache.stats()
+        self.assertEqual(after['l1']['hits'] - before['l1']['hits'], 2)
+        self.assertEqual(after['l1']['misses'] - before['l1']['misses'], 2)
+        self.assertEqual(after['l2']['hits'] - before['l2']['hits'], 1)
+        self.assertEqual(after['l2']['misses'] - before['l2']['misses'], 1)
+
+    def test_generations_reach_other_processes(self):
+        """Поколение, сменённое другим воркером в L2, видно сразу."""
+        post = Post.objects.create(
+            author=User.objects.create_user(username='author'), text='-')
+        url = reverse('posts:index')
+        self.client.get(url)
+        self.shared.set(caching.generation_key('posts'),
+                        caching.new_generation(), None)
+        post.text = 'Правка из другого воркера'
+        Post.objects.filter(pk=post.pk).update(text=post.text)
+        self.assertContains(self.client.get(url), post.text)
+
+    def test_local_tier_is_bounded(self):
+        tiered = TieredCache('shared', {'OPTIONS': {'MAX_ENTRIES': 2}})
+        for key in ('tiers:a', 'tiers:b', 'tiers:c'):
+            tiered.set(key, key)
+        self.assertEqual(tiered.stats()['l1']['entries'], 2)
+        self.shared.delete('tiers:a')
+        self.assertIsNone(tiered.get('tiers:a'))
+        self.assertEqual(tiered.get('tiers:c'), 'tiers:c')
+
+    def test_file_cache_lists_directory_rarely(self):
+        with tempfile.TemporaryDirectory() as directory:
+            files = FileCache(directory, {'OPTIONS': {'CULL_EVERY': 10}})
+            with mock.patch.object(
+                    FileCache, '_list_cache_files',
+                    wraps=files._list_cache_files) as listing:
+                for number in range(20):
+                    files.set(f'files:{number}', number)
+            self.assertEqual(listing.call_count, 2)
+            self.assertEqual(files.get('files:19'), 19)
+
+    def test_file_cache_add_has_one_winner(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for trial in range(30):
+                barrier = threading.Barrier(8)
+                winners = []
+
+                def race():
+                    # Свой экземпляр на поток, как в отдельном процессе.
+                    files = FileCache(directory, {})
+                    barrier.wait()
+                    if files.add(f'lock:{trial}', True, 60):
+                        winners.append(1)
+                threads = [threading.Thread(target=race) for _ in range(8)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                self.assertEqual(len(winners), 1)
+
+    def test_file_cache_add_replaces_expired_entry(self):
+        with tempfile.TemporaryDirectory() as directory:
+            files = FileCache(directory, {})
+            self.assertTrue(files.add('lock:key', 'старый', 60))
+            self.assertFalse(files.add('lock:key', 'новый', 60))
+            files.set('lock:key', 'старый', -1)
+            self.assertTrue(files.add('lock:key', 'новый', 60))
+            self.assertEqual(files.get('lock:key'), 'новый')
+
+    def test_tests_do_not_share_server_cache(self):
+        self.assertNotIsInstance(self.shared, FileCache)
+
+
+class SingleFlightTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_concurrent_misses_compute_once(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'значение'
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            singleflight.fetch('flight:key', compute, 60)))
+            for _ in range(5)]
+        before = singleflight.stats()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['значение'] * 5)
+        self.assertEqual(singleflight.stats()['waited'] - before['waited'],
+                         4)
+
+    def test_stale_value_served_while_locked(self):
+        singleflight.fetch('flight:key', lambda: 'старое', 60)
+        cache.add(singleflight.lock_key('flight:key'), True)
+        before = singleflight.stats()['stale_served']
+        value = singleflight.fetch('flight:key', lambda: 'новое', 60,
+                                   fresh=lambda value: False)
+        self.assertEqual(value, 'старое')
+        self.assertEqual(singleflight.stats()['stale_served'], before + 1)
+        cache.delete(singleflight.lock_key('flight:key'))
+        value = singleflight.fetch('flight:key', lambda: 'новое', 60,
+                                   fresh=lambda value: False)
+        self.assertEqual(value, 'новое')
+
+    def test_early_refresh_near_expiry(self):
+        now = time.time()
+        self.assertTrue(singleflight.refresh_early(
+            singleflight.Entry('-', 1000, now + 1), beta=1))
+        self.assertFalse(singleflight.refresh_early(
+            singleflight.Entry('-', 0.001, now + 3600), beta=1))
+        self.assertFalse(singleflight.refresh_early(
+            singleflight.Entry('-', 1000, None)))
+
+    def test_fetch_many_waits_for_other_renderer(self):
+        cache.add(singleflight.lock_key('flight:b'), True)
+
+        def other():
+            time.sleep(0.1)
+            cache.set('flight:b', singleflight.Entry('чужая', 0, None))
+        thread = threading.Thread(target=other)
+        thread.start()
+        rendered = []
+        found = singleflight.fetch_many(
+            ['flight:a', 'flight:b'],
+            lambda keys: rendered.extend(keys) or dict.fromkeys(keys, 'моя'),
+            60)
+        thread.join()
+        self.assertEqual(found, {'flight:a': 'моя', 'flight:b': 'чужая'})
+        self.assertEqual(rendered, ['flight:a'])
+
+
+class HolePunchTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.post = Post.objects.create(author=cls.author, text='Текст')
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def test_logged_in_users_share_anonymous_page(self):
+        url = reverse('posts:index')
+        self.assertContains(self.client.get(url), 'Войти')
+        # update() не сбрасывает поколения: видна ли правка, зависит
+        # только от того, взята ли страница из общего кэша.
+        Post.objects.filter(pk=self.post.pk).update(text='Правка')
+        response = self.reader_client.get(url)
+        self.assertContains(response, 'Текст')
+        self.assertContains(response, 'Пользователь: <b>reader</b>',
+                            html=False)
+        self.assertNotContains(response, 'Войти')
+        self.assertNotContains(response, '<!--hole:')
+
+    def test_personal_buttons_per_user(self):
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        author_client = Client()
+        author_client.force_login(self.author)
+        response = author_client.get(url)
+        self.assertContains(response, 'Рудактировать')
+        self.assertContains(response, 'csrfmiddlewaretoken')
+        response = self.reader_client.get(url)
+        self.assertNotContains(response, 'Рудактировать')
+        self.assertContains(response, 'Ваш комментарий')
+        response = self.client.get(url)
+        self.assertNotContains(response, 'Ваш комментарий')
+
+    def test_placeholder_in_user_text_is_escaped(self):
+        text = holes.placeholder('includes/header.html', {})
+        post = Post.objects.create(author=self.author, text=text)
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': post.pk}))
+        self.assertContains(response, '&lt;!--hole:')
+        self.assertEqual(response.content.count(b'<header>'), 1)
+
+
+class MetricsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.staff = User.objects.create_user(username='staff',
+                                             is_staff=True)
+        Post.objects.create(author=cls.author, text='Текст')
+
+    def setUp(self):
+        cache.clear()
+        metrics.REGISTRY.reset()
+
+    def test_server_timing_parts(self):
+        response = self.client.get(reverse('posts:index'))
+        timing = response['Server-Timing']
+        for part in ('total;dur=', 'db;dur=', 'queries"', 'tpl;dur=',
+                     'cache-l1;desc="hit=', 'cache-l2;desc="hit='):
+            with self.subTest(part=part):
+                self.assertIn(part, timing)
+
+    def test_metrics_endpoint_aggregates_by_view(self):
+        self.client.get(reverse('posts:index'))
+        self.client.get(reverse('posts:index'))
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response['Content-Type'],
+                         'text/plain; version=0.0.4; charset=utf-8')
+        text = response.content.decode()
+        self.assertIn('# TYPE yatube_request_duration_seconds histogram',
+                      text)
+        self.assertIn('yatube_request_duration_seconds_bucket'
+                      '{view="posts:index",le="+Inf"} 2', text)
+        self.assertIn('yatube_requests_total'
+                      '{view="posts:index",status="200"} 2', text)
+        self.assertIn('yatube_db_queries_total{view="posts:index"}', text)
+        self.assertIn('yatube_cache_requests_total{view="posts:index",'
+                      'tier="l1",result="hit"}', text)
+
+    def test_metrics_closed_without_token(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code,
+                         HTTPStatus.FORBIDDEN)
+        self.assertEqual(
+            self.client.get(url, HTTP_AUTHORIZATION='Bearer ').status_code,
+            HTTPStatus.FORBIDDEN)
+        self.client.force_login(self.author)
+        self.assertEqual(self.client.get(url).status_code,
+                         HTTPStatus.FORBIDDEN)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_token(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code,
+                         HTTPStatus.FORBIDDEN)
+        response = self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, HTTPStatus.FORBIDDEN)
+        response = self.client.get(url, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+
+class SlowQueryTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        Post.objects.create(author=cls.author, text='Текст')
+
+    def test_queries_attributed_to_view_and_template(self):
+        client = Client()
+        client.force_login(self.author)
+        # Порог снижен только внутри assertLogs: иначе записи попали бы
+        # в настоящий журнал.
+        with override_settings(SLOW_QUERY_THRESHOLD_MS=0), \
+                self.assertLogs('yatube.slow_queries', 'WARNING') as logs:
+            client.get(reverse('about:author'))
+        entries = [json.loads(record.getMessage())
+                   for record in logs.records]
+        self.assertEqual({entry['view'] for entry in entries},
+                         {'about:author'})
+        # Сессию и пользователя первой читает шапка страницы.
+        entry = entries[0]
+        self.assertTrue(entry['template'].startswith('includes/header.html:'))
+        self.assertIn('user.is_authenticated', entry['template'])
+        self.assertIn('core/holes.py', ' '.join(entry['stack']))
+        self.assertNotIn("'", ' '.join(entry['sql'] for entry in entries))
+
+    def test_normalize_collapses_values(self):
+        self.assertEqual(
+            slow_queries.normalize(
+                "SELECT * FROM t WHERE id IN (%s, %s, %s) AND a = 'x'\n"
+                'LIMIT 21'),
+            'SELECT * FROM t WHERE id IN (?, ...) AND a = ? LIMIT ?')
+
+    def test_summary_command_ranks_by_total_time(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'slow.log')
+        entries = [('a', 'posts:index', 30), ('a', 'posts:index', 40),
+                   ('b', 'posts:profile', 50)]
+        for name, (fingerprint, view, duration) in zip(
+                (path + '.1', path, path), entries):
+            with open(name, 'a', encoding='utf-8') as stream:
+                stream.write(json.dumps({
+                    'fingerprint': fingerprint, 'sql': f'SELECT {view}',
+                    'view': view, 'template': None,
+                    'duration_ms': duration}) + '\n')
+        out = StringIO()
+        call_command('slow_queries', log=path, json=True, stdout=out)
+        groups = json.loads(out.getvalue())
+        self.assertEqual([group['fingerprint'] for group in groups],
+                         ['a', 'b'])
+        self.assertEqual(groups[0]['count'], 2)
+        self.assertEqual(groups[0]['total_ms'], 70)
+        self.assertEqual(groups[0]['views'], {'posts:index': 2})
+        with self.assertRaises(CommandError):
+            call_command('slow_queries', log=path + '.missing')
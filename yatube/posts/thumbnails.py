@@ -0,0 +1,128 @@
+"""Адаптивные варианты картинок постов.
+
+Варианты создаёт фоновый пул сразу после загрузки картинки (или
+команда pregenerate_thumbnails) обычным sorl-thumbnail и записывает их
+имена в post.image_variants. Шаблоны только читают это поле и картинок
+не обрабатывают.
+"""
+import json
+import logging
+import threading
+from concurrent import futures
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connections
+from PIL import features
+from sorl.thumbnail import get_thumbnail
+
+from core import metrics
+
+from . import caching, objects
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+_pending = {}
+_lock = threading.Lock()
+_executor = None
+
+
+def variant_formats():
+    return [image_format for image_format in settings.IMAGE_VARIANT_FORMATS
+            if image_format != 'WEBP' or features.check('webp')]
+
+
+def variant_geometries():
+    """(формат, ширина, геометрия, опции) для адаптивных вариантов."""
+    width, height = settings.IMAGE_VARIANT_ASPECT
+    for image_format in variant_formats():
+        for variant_width in settings.IMAGE_VARIANT_WIDTHS:
+            variant_height = round(variant_width * height / width)
+            geometry = f'{variant_width}x{variant_height}'
+            options = {'crop': 'center', 'upscale': True,
+                       'format': image_format}
+            yield image_format, variant_width, geometry, options
+
+
+def record_variants(name, variants):
+    """Записывает варианты картинки name в её посты.
+
+    Посты меняются через update(), поэтому их объекты и страницы
+    сбрасываются здесь же: иначе страницы из кэша показывали бы пустую
+    рамку вместо картинки. Возвращает число постов.
+    """
+    posts = list(Post.objects.filter(image=name))
+    Post.objects.filter(pk__in=[post.pk for post in posts],
+                        image=name).update(image_variants=json.dumps(variants))
+    for post in posts:
+        objects.forget(Post, post.pk)
+        caching.bump(*caching.post_generations(post))
+    return len(posts)
+
+
+def srcsets(post):
+    """srcset для каждого формата и src самого широкого JPEG."""
+    variants = json.loads(post.image_variants)
+    context = {
+        image_format: ', '.join(
+            f'{default_storage.url(name)} {width}w' for width, name in items)
+        for image_format, items in variants.items()
+    }
+    if variants.get('jpeg'):
+        context['src'] = default_storage.url(variants['jpeg'][-1][1])
+    return context
+
+
+def generate(name):
+    """Создаёт адаптивные варианты картинки и записывает их в посты.
+
+    Первым создаётся самый узкий JPEG и записывается сразу: пока готовят
+    остальные, карточка показывает его, а не оригинал.
+    """
+    if not default_storage.exists(name):
+        logger.warning('Картинки %s нет в хранилище', name)
+        return 0
+    geometries = sorted(variant_geometries(),
+                        key=lambda item: (item[0] != 'JPEG', item[1]))
+    variants = {}
+    with metrics.timer('thumbnail'):
+        for number, (image_format, width, geometry, options) in enumerate(
+                geometries):
+            thumbnail = get_thumbnail(name, geometry, **options)
+            variants.setdefault(image_format.lower(), []).append(
+                [width, thumbnail.name])
+            if number == 0:
+                record_variants(name, variants)
+    return record_variants(name, variants)
+
+
+def _generate_in_background(name):
+    try:
+        generate(name)
+    except Exception:
+        logger.exception('Не удалось создать миниатюры для %s', name)
+    finally:
+        connections.close_all()
+        with _lock:
+            _pending.pop(name, None)
+
+
+def schedule(name):
+    """Ставит генерацию миниатюр в фоновый пул, без повторов."""
+    global _executor
+    with _lock:
+        if name in _pending:
+            return
+        if _executor is None:
+            _executor = futures.ThreadPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails')
+        _pending[name] = _executor.submit(_generate_in_background, name)
+
+
+def wait():
+    """Дожидается всех поставленных в пул задач."""
+    with _lock:
+        pending = list(_pending.values())
+    futures.wait(pending)
@@ -0,0 +1,194 @@
+"""Ленты подписок: fan-out on write и посты «знаменитостей» при чтении.
+
+Пост обычного автора при публикации записывается в TimelineEntry
+каждого читателя вместе с датой публикации. Посты авторов, у которых
+не меньше TIMELINE_FANOUT_LIMIT читателей (флаг UserCounters.celebrity),
+не рассылаются, а читаются при запросе. Страница ленты (FeedPaginator)
+берёт по ключу (-pub_date, -post) не больше страницы записей из индекса
+ленты и столько же постов каждой знаменитости из индекса её постов
+и сливает их: цена не зависит ни от числа подписок, ни от длины ленты.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Q
+
+from core import singleflight
+from core.paginators import CursorPaginator, keyset
+
+from . import following
+from .models import Follow, Post, TimelineEntry, UserCounters
+
+CELEBRITIES_KEY = 'timelines:celebrities'
+
+
+def is_celebrity(author_id):
+    return UserCounters.objects.filter(pk=author_id, celebrity=True).exists()
+
+
+def celebrity_ids():
+    """Авторы, чьи посты читаются из ленты при запросе (fan-out on read)."""
+    return singleflight.fetch(
+        CELEBRITIES_KEY, _celebrities, settings.TIMELINE_CELEBRITIES_TTL)
+
+
+def _celebrities():
+    return set(UserCounters.objects.filter(celebrity=True).values_list(
+        'pk', flat=True))
+
+
+def update_celebrity(author_id):
+    """Переключает флаг «знаменитости» по счётчику подписчиков автора.
+
+    Вызывается при подписке и отписке. Каждое переключение делает ровно
+    один запрос: UPDATE с условием на старое значение флага. Если автор
+    перестал быть «знаменитостью», его посты, опубликованные за это время,
+    дописываются в ленты читателей, иначе они пропали бы из лент.
+    """
+    limit = settings.TIMELINE_FANOUT_LIMIT
+    authors = UserCounters.objects.filter(pk=author_id)
+    if authors.filter(celebrity=False, followers__gte=limit).update(
+            celebrity=True):
+        cache.delete(CELEBRITIES_KEY)
+    elif authors.filter(celebrity=True, followers__lt=limit).update(
+            celebrity=False):
+        _fill(author_id)
+        cache.delete(CELEBRITIES_KEY)
+
+
+def fan_out(post):
+    if is_celebrity(post.author_id):
+        return
+    followers = Follow.objects.filter(
+        author=post.author_id).values_list('user', flat=True)
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+         for user_id in followers),
+        batch_size=500, ignore_conflicts=True)
+
+
+def backfill(follow):
+    if is_celebrity(follow.author_id):
+        return
+    posts = Post.objects.filter(author=follow.author_id).values_list(
+        'pk', 'pub_date')[:settings.TIMELINE_BACKFILL_LIMIT]
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=follow.user_id, post_id=post_id,
+                       pub_date=pub_date)
+         for post_id, pub_date in posts),
+        batch_size=500, ignore_conflicts=True)
+
+
+def _fill(author_id):
+    """Свежие посты автора во все ленты его читателей одним запросом."""
+    recent = Post.objects.filter(author=author_id).values(
+        'pk', 'pub_date')[:settings.TIMELINE_BACKFILL_LIMIT]
+    sql, params = recent.query.sql_with_params()
+    entries = TimelineEntry._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {entries} (user_id, post_id, pub_date) '
+            f'SELECT follow.user_id, recent.id, recent.pub_date '
+            f'FROM {Follow._meta.db_table} AS follow, ({sql}) AS recent '
+            f'WHERE follow.author_id = %s AND NOT EXISTS ('
+            f'SELECT 1 FROM {entries} AS entry '
+            f'WHERE entry.user_id = follow.user_id '
+            f'AND entry.post_id = recent.id)',
+            (*params, author_id))
+
+
+def rebuild():
+    """Перестраивает ленты по всем подпискам, например после bulk-импорта.
+
+    Флаги «знаменитостей» пересчитываются по счётчикам подписчиков
+    (counters.reconcile должен быть выполнен раньше). Записи каждого
+    автора вставляются одним INSERT ... SELECT сразу всем его читателям.
+    Возвращает число записей в лентах.
+    """
+    limit = settings.TIMELINE_FANOUT_LIMIT
+    celebrities = UserCounters.objects.filter(celebrity=True).values('pk')
+    authors = Follow.objects.exclude(author__in=celebrities).order_by(
+        'author').values_list('author', flat=True).distinct()
+    with transaction.atomic():
+        UserCounters.objects.filter(followers__gte=limit).exclude(
+            celebrity=True).update(celebrity=True)
+        UserCounters.objects.filter(followers__lt=limit).exclude(
+            celebrity=False).update(celebrity=False)
+        TimelineEntry.objects.all().delete()
+        for author_id in authors.iterator():
+            _fill(author_id)
+    cache.delete(CELEBRITIES_KEY)
+    return TimelineEntry.objects.count()
+
+
+def trim(follow):
+    TimelineEntry.objects.filter(
+        user=follow.user_id, post__author=follow.author_id).delete()
+
+
+def feed(user):
+    """Лента подписок одним запросом: для подсчёта, не для страниц."""
+    materialized = TimelineEntry.objects.filter(user=user).values('post')
+    condition = Q(pk__in=materialized)
+    followed = celebrity_ids() & following.followed_ids(user.pk)
+    if followed:
+        condition |= Q(author__in=sorted(followed))
+    return Post.objects.filter(condition)
+
+
+ENTRY_ORDERING = ('-pub_date', '-post')
+POST_ORDERING = ('-pub_date', '-pk')
+
+
+def post_ids(user, celebrities, position=None, reverse=False, limit=10):
+    """id первых limit постов ленты после позиции (pub_date, pk).
+
+    Каждый источник — записи ленты и посты каждой знаменитости — читается
+    по своему индексу не дальше limit строк, итог сливается здесь.
+    """
+    sources = [(TimelineEntry.objects.filter(user=user).values_list(
+        'pub_date', 'post'), ENTRY_ORDERING)]
+    sources += [(Post.objects.filter(author=author_id).values_list(
+        'pub_date', 'pk'), POST_ORDERING) for author_id in celebrities]
+    rows = set()
+    for source, ordering in sources:
+        source = source.order_by(*ordering)
+        if position is not None:
+            source = source.filter(keyset(ordering, position, reverse))
+        if reverse:
+            source = source.reverse()
+        rows.update(source[:limit])
+    # Пост знаменитости может быть и в записях ленты (разослан раньше).
+    return [pk for _, pk in sorted(rows, reverse=not reverse)[:limit]]
+
+
+class FeedPaginator(CursorPaginator):
+    """Страницы ленты подписок user по ключу (-pub_date, -pk).
+
+    object_list — посты без условия ленты (с нужными select_related или
+    values): из него читаются только посты страницы по id.
+    """
+
+    def __init__(self, object_list, per_page, user, count=None, **kwargs):
+        self.user = user
+        self.celebrities = sorted(
+            celebrity_ids() & following.followed_ids(user.pk))
+        if count is None:
+            count = feed(user).count
+        super().__init__(object_list, per_page, count=count, **kwargs)
+
+    def _fetch(self, ids):
+        rows = {self._position(row)[-1]: row
+                for row in self.object_list.order_by().filter(pk__in=ids)}
+        return [rows[pk] for pk in ids if pk in rows]
+
+    def _window(self, position, reverse, limit):
+        return self._fetch(post_ids(self.user, self.celebrities, position,
+                                    reverse, limit))
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        ids = post_ids(self.user, self.celebrities,
+                       limit=bottom + self.per_page)[bottom:]
+        return self._get_page(self._fetch(ids), number, self)
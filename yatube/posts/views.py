@@ -1,23 +1,55 @@
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from .models import Post, Group, User, Follow
+from .models import Comment, Post, Group, User, Follow
 from .forms import PostForm, CommentForm
+from . import objects, timelines
+from .counters import get_counters
+from .search import find_posts
 from django.shortcuts import redirect
-from django.core.paginator import Paginator
-from django.views.decorators.cache import cache_page
+from core.counts import cached_count
+from core.paginators import CursorPaginator, paginate
+from .caching import cache_page_by_generation
 
 text_output: int = 10
+comments_output: int = 20
 
 
-@cache_page(20, key_prefix='index')
+# Поколения, от которых зависят страницы: по ним до вызова view
+# считаются ETag и Last-Modified и проверяется кэш страницы.
+def index_generations(request):
+    return ('posts', 'groups')
+
+
+def group_generations(request, slug):
+    group = objects.get(Group, slug=slug)
+    return None if group is None else (f'group:{group.pk}',)
+
+
+def profile_generations(request, username):
+    user = objects.get(User, username=username)
+    return None if user is None else (f'profile:{user.pk}', 'groups')
+
+
+def post_generations(request, post_id):
+    post = objects.get(Post, post_id)
+    if post is None:
+        return None
+    return (f'post:{post_id}', f'profile:{post.author_id}', 'groups')
+
+
+def comments_generations(request, post_id):
+    if objects.get(Post, post_id) is None:
+        return None
+    return (f'post:{post_id}',)
+
+
+@cache_page_by_generation(index_generations)
 def index(request):
     template = 'posts/index.html'
-    post_list = Post.objects.all()
-    paginator = Paginator(post_list, text_output)
-    page_number = request.GET.get('page')
-    if(not page_number):
-        page_number = 1
-    page_obj = paginator.get_page(page_number)
+    post_list = Post.objects.select_related('author', 'group')
+    page_obj = paginate(
+        request, post_list, text_output,
+        count=lambda: cached_count('posts', Post.objects.all()))
     context = {
         'page_obj': page_obj,
         'post_list': post_list,
@@ -25,70 +57,113 @@ def index(request):
     return render(request, template, context)
 
 
+@cache_page_by_generation(group_generations)
 def group_posts(request, slug):
     template = 'posts/group_list.html'
-    group = get_object_or_404(Group, slug=slug)
-    posts = group.posts_group.all()[:text_output]
-    paginator = Paginator(posts, text_output)
-    page_number = request.GET.get('page')
-    if(not page_number):
-        page_number = 1
-    page_obj = paginator.get_page(page_number)
+    group = objects.get_or_404(Group, slug=slug)
+    posts = group.posts_group.select_related('author', 'group')
+    page_obj = paginate(
+        request, posts, text_output,
+        count=lambda: cached_count(f'group:{group.pk}', group.posts_group))
     context = {
         'page_obj': page_obj,
         'group': group,
-        'posts': posts
+    }
+    return render(request, template, context)
+
+
+def search(request):
+    template = 'posts/search.html'
+    query = request.GET.get('q', '').strip()
+    try:
+        page_number = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page_number = 1
+    posts, has_next = [], False
+    if query:
+        posts, has_next = find_posts(
+            query, (page_number - 1) * text_output, text_output)
+    context = {
+        'query': query,
+        'posts': posts,
+        'page_number': page_number,
+        'has_next': has_next,
     }
     return render(request, template, context)
 
 
 @login_required
 def post_delete(request, post_id):
+    # Запись идёт по строке из БД, а не по копии из кэша объектов.
     post = get_object_or_404(Post, pk=post_id)
-    if post.author == request.user:
+    if post.author_id == request.user.pk:
         post.delete()
-    return redirect('posts:profile', post.author.username)
+        return redirect('posts:profile', request.user.username)
+    return redirect('posts:profile',
+                    objects.get_or_404(User, post.author_id).username)
 
 
+@cache_page_by_generation(profile_generations)
 def profile(request, username):
-    page_number = request.GET.get('page')
-    profile = get_object_or_404(User, username=username)
-    post_list = profile.posts_author.all()
-    post_count = post_list.count
-    paginator = Paginator(post_list, text_output)
-    page_obj = paginator.get_page(page_number)
-    following = Follow.objects.filter(user=request.user.id,
-                                      author=profile.id).exists()
+    profile = objects.get_or_404(User, username=username)
+    post_list = profile.posts_author.select_related('author', 'group')
+    counters = get_counters(profile)
+    # Число постов автора уже есть в счётчиках, COUNT(*) не нужен.
+    page_obj = paginate(request, post_list, text_output,
+                        count=counters.posts)
     context = {
-        'following': following,
         'profile': profile,
         'page_obj': page_obj,
-        'paginator': paginator,
-        'post_count': post_count
+        'paginator': page_obj.paginator,
+        'post_count': counters.posts,
+        'counters': counters,
     }
     return render(request, 'posts/profile.html', context)
 
 
+@cache_page_by_generation(post_generations)
 def post_detail(request, post_id):
     template = 'posts/post_detail.html'
-    post = get_object_or_404(Post, pk=post_id)
-    post_count = post.author.posts_author.count()
-    comments = post.comments.all()
-    form = CommentForm()
+    post = objects.get_or_404(Post, post_id)
+    post.author = objects.get_or_404(User, post.author_id)
+    if post.group_id is not None:
+        post.group = objects.get(Group, post.group_id)
+    post_count = get_counters(post.author).posts
+    comments = comment_page(post.pk)
     context = {
         'post': post,
         'post_count': post_count,
         'comments': comments,
-        'form': form,
     }
     return render(request, template, context)
 
 
+def comment_page(post_id, cursor=None):
+    """Страница комментариев поста в порядке написания."""
+    comments = Comment.objects.filter(post=post_id).select_related('author')
+    paginator = CursorPaginator(comments, comments_output,
+                                ordering=('created', 'pk'))
+    return paginator.cursor_page(cursor)
+
+
+@cache_page_by_generation(comments_generations)
+def post_comments(request, post_id):
+    """HTML следующих комментариев для кнопки «Показать ещё»."""
+    objects.get_or_404(Post, post_id)
+    context = {
+        'post_id': post_id,
+        'comments': comment_page(post_id, request.GET.get('cursor')),
+    }
+    return render(request, 'posts/includes/comments.html', context)
+
+
 @login_required
 def post_create(request):
     template = 'posts/post_create.html'
-    author = get_object_or_404(User, pk=request.user.id)
-    form = PostForm(request.POST or None, initial={'author': author.id})
+    author = objects.get_or_404(User, request.user.pk)
+    form = PostForm(request.POST or None,
+                    files=request.FILES or None,
+                    initial={'author': author.id})
     if form.is_valid():
         post = form.save(commit=False)
         post.author = request.user
@@ -102,8 +177,10 @@ def post_create(request):
 @login_required
 def post_edit(request, post_id):
     template = 'posts/post_create.html'
+    # Полный save() копии из кэша затёр бы счётчики и варианты
+    # картинок, которые меняются через update().
     post = get_object_or_404(Post, pk=post_id)
-    if post.author != request.user:
+    if post.author_id != request.user.pk:
         return redirect('posts:post_detail', post_id)
     form = PostForm(request.POST or None,
                     files=request.FILES or None,
@@ -134,10 +211,12 @@ def add_comment(request, post_id):
 def follow_index(request):
     template = 'posts/follow.html'
     title = 'Избранные авторы'
-    posts = Post.objects.filter(author__following__user=request.user)
-    paginator = Paginator(posts, text_output)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    posts = Post.objects.select_related('author', 'group')
+    page_obj = paginate(
+        request, posts, text_output,
+        count=lambda: cached_count(f'feed:{request.user.pk}',
+                                   timelines.feed(request.user)),
+        paginator_class=timelines.FeedPaginator, user=request.user)
     context = {
         'title': title,
         'page_obj': page_obj,
@@ -147,7 +226,7 @@ def follow_index(request):
 
 @login_required
 def profile_follow(request, username):
-    author = get_object_or_404(User, username=username)
+    author = objects.get_or_404(User, username=username)
     user = request.user
     if author != user:
         Follow.objects.get_or_create(user=user, author=author)
@@ -11,6 +11,8 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import sys
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -57,11 +59,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
+    'core.slow_queries.SlowQueryMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.holes.HolePunchMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -71,7 +76,9 @@ ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Обычный DjangoTemplates, который замеряет рендер для
+        # Server-Timing и /metrics/.
+        'BACKEND': 'core.metrics.TimedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -81,6 +88,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'core.context_processors.year.year',
+                'posts.context_processors.followed_ids',
             ],
         },
     },
@@ -118,12 +126,110 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Небольшой кэш в памяти каждого воркера перед общим для всех файловым.
+# Ключи из L2_ONLY всегда читаются из общего кэша: по поколениям
+# воркеры узнают о записях друг друга.
+CACHE_DIR = os.environ.get('YATUBE_CACHE_DIR',
+                           os.path.join(BASE_DIR, 'cache'))
 CACHES = {
     'default': {
+        'BACKEND': 'core.caches.TieredCache',
+        'LOCATION': 'shared',
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+            'L1_TIMEOUT': 5,
+            'L2_ONLY': ('generation:', 'following:', 'timelines:',
+                        'lock:', 'objects:'),
+        },
+    },
+    'shared': {
+        # Каталог обходится для чистки раз в CULL_EVERY записей.
+        'BACKEND': 'core.caches.FileCache',
+        'LOCATION': CACHE_DIR,
+        'OPTIONS': {'MAX_ENTRIES': 100000, 'CULL_EVERY': 1000},
+    },
+}
+
+# Тесты работают со своим общим кэшем в памяти: данные тестовой БД не
+# должны попасть к серверу, а cache.clear() в тестах — стереть его кэш.
+TESTING = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+if TESTING:
+    CACHES['shared'] = {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'yatube-tests',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
     }
+
+# Страницы кэшируются надолго: записи в БД сбрасывают их поколения.
+PAGE_CACHE_TIMEOUT = 60 * 60 * 6
+CARD_CACHE_TIMEOUT = 60 * 60 * 24
+# Устаревший ключ пересчитывает один запрос (core.singleflight): он
+# держит блокировку не дольше LOCK_TIMEOUT, остальные ждут готового
+# значения не дольше WAIT секунд. BETA > 1 обновляет записи раньше.
+SINGLE_FLIGHT_LOCK_TIMEOUT = 10
+SINGLE_FLIGHT_WAIT = 2
+EARLY_REFRESH_BETA = 1.0
+# Сколько секунд число постов для нумерованных страниц считается
+# свежим; устаревшее пересчитывается в фоне пулом из COUNT_WORKERS
+# потоков.
+COUNT_CACHE_TIMEOUT = 60
+COUNT_WORKERS = 2
+# Объекты Post, Group и User сбрасываются сигналами их сохранения.
+OBJECT_CACHE_TIMEOUT = 60 * 60 * 24
+# Подписки пользователя сбрасываются сигналами Follow.
+FOLLOWING_CACHE_TIMEOUT = 60 * 60 * 24
+
+# /metrics/ без DEBUG видят сотрудники и запросы с заголовком
+# Authorization: Bearer <токен>; пустой токен никого не пускает.
+METRICS_TOKEN = ''
+
+# Запросы к БД дольше порога пишутся в журнал медленных запросов;
+# сводка — manage.py slow_queries. В журнал пишут все воркеры, поэтому
+# его ротирует logrotate, а WatchedFileHandler переоткрывает файл.
+SLOW_QUERY_THRESHOLD_MS = 100
+SLOW_QUERY_LOG = os.path.join(tempfile.gettempdir(),
+                              'yatube-slow-queries.log')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'slow_queries': {
+            'class': 'logging.handlers.WatchedFileHandler',
+            'filename': SLOW_QUERY_LOG,
+            'encoding': 'utf-8',
+            'delay': True,
+            'formatter': 'message',
+        },
+    },
+    'loggers': {
+        'yatube.slow_queries': {
+            'handlers': ['slow_queries'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
 }
 
+# Миниатюры создаются фоновым пулом сразу после загрузки картинки;
+# шаблоны только читают готовые файлы.
+THUMBNAIL_WORKERS = 2
+# Адаптивные варианты картинок поста для srcset: ширины и форматы
+# (WebP пропускается, если Pillow собран без него).
+IMAGE_VARIANT_ASPECT = (960, 339)
+IMAGE_VARIANT_WIDTHS = (320, 480, 640, 960)
+IMAGE_VARIANT_FORMATS = ('WEBP', 'JPEG')
+IMAGE_VARIANT_SIZES = '(min-width: 992px) 960px, 100vw'
+
+# Ленты подписок: авторы с числом подписчиков от TIMELINE_FANOUT_LIMIT
+# не рассылаются по лентам при публикации, а читаются при запросе.
+TIMELINE_FANOUT_LIMIT = 1000
+TIMELINE_BACKFILL_LIMIT = 1000
+TIMELINE_CELEBRITIES_TTL = 60 * 5
+
 # Internationalization
 # https://docs.djangoproject.com/en/2.2/topics/i18n/
 